@@ -1,7 +1,9 @@
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 
+from job_handler.job import track
+
 
 class Correspondence:
     """Convert a 2D coordinate to a corresponded 3D coordinate
@@ -19,6 +21,31 @@ class Correspondence:
         """
         self.dcm_info = dcm_info
         self.affine_mat = None
+        # results that only depend on dcm_info are computed once
+        self.cache = {}
+
+    def generate_matrices(self) -> np.ndarray:
+        """Generate Affine Formula of every dicom image at once
+
+        Returns
+        -------
+        numpy.ndarray
+            affine matrix of each dicom image (shape = (the number of dicom images, 4, 4))
+        """
+        if 'affine' not in self.cache:
+            pixel_space = np.asarray([dcm.PixelSpacing for dcm in self.dcm_info], dtype=np.float64)
+            orientation = np.asarray([dcm.ImageOrientationPatient for dcm in self.dcm_info], dtype=np.float64)
+            position = np.asarray([dcm.ImagePositionPatient for dcm in self.dcm_info], dtype=np.float64)
+
+            # same layout as generate_matrix
+            affine = np.zeros((len(self.dcm_info), 4, 4), dtype=np.float64)
+            affine[:, :3, 0] = orientation[:, :3] * pixel_space[:, 1:2]
+            affine[:, :3, 1] = orientation[:, 3:] * pixel_space[:, 0:1]
+            affine[:, :3, 3] = position
+            affine[:, 3, 3] = 1
+            self.cache['affine'] = affine
+
+        return self.cache['affine']
 
     def generate_matrix(self, index: int) -> None:
         """Generate Affine Formula based on a dicom metadata
@@ -28,14 +55,7 @@ class Correspondence:
         index : int
             the index of dicom metadata set
         """
-        row_space, col_space = [self.dcm_info[index].PixelSpacing[i] for i in (0, 1)]
-        Xx, Xy, Xz, Yx, Yy, Yz = [self.dcm_info[index].ImageOrientationPatient[i] for i in (0, 1, 2, 3, 4, 5)]
-        Sx, Sy, Sz = [self.dcm_info[index].ImagePositionPatient[i] for i in (0, 1, 2)]
-
-        self.affine_mat = np.asarray([[Xx * col_space, Yx * row_space, 0, Sx],
-                                      [Xy * col_space, Yy * row_space, 0, Sy],
-                                      [Xz * col_space, Yz * row_space, 0, Sz],
-                                      [0, 0, 0, 1]])
+        self.affine_mat = self.generate_matrices()[index]
 
     def convert_2d_3d(self, indicies: List) -> np.ndarray:
         """Convert coordinate in a dicom image to 3d coordinate
@@ -51,13 +71,15 @@ class Correspondence:
         numpy.ndarray
             3d coordinate
         """
-        coor_3d = []
-        for dcm_index, loc_li in indicies:
-            self.generate_matrix(dcm_index)
-            for coor in loc_li:
-                coor_3d.append(np.delete(np.matmul(self.affine_mat, np.append(coor, [0, 1])), -1))
+        affine = self.generate_matrices()
 
-        return np.asarray(coor_3d, dtype=np.float64)
+        coor_3d = [np.empty((0, 3), dtype=np.float64)]
+        for dcm_index, loc_li in track(indicies, 'converting 2d coordinate to 3d coordinate'):
+            loc_li = np.asarray(loc_li, dtype=np.float64).reshape(-1, 2)
+            # every coordinate of a dicom image is transformed by one matrix product
+            coor_3d.append(loc_li @ affine[dcm_index, :3, :2].T + affine[dcm_index, :3, 3])
+
+        return np.concatenate(coor_3d)
 
     def calculate_voxel_center(self, coor_3d: np.ndarray) -> (np.ndarray, np.ndarray):
         """Calculate the 3D coordinate for the center of a voxel point
@@ -81,13 +103,14 @@ class Correspondence:
         voxel_size = self.calculate_voxel_size()
 
         # calculate the 3D coordinate for the center of a voxel point
-        voxel_coor = []
-        for point in coor_3d:
-            voxel_coor.append(point + (voxel_size / 2))
+        voxel_coor = np.asarray(coor_3d, dtype=np.float64) + voxel_size / 2
 
-        return np.asarray(voxel_coor, dtype=np.float64), voxel_size
+        return voxel_coor, voxel_size
 
     def calculate_voxel_size(self):
+        if 'voxel_size' in self.cache:
+            return self.cache['voxel_size'].copy()
+
         # get the thickness in the dicom image set
         # assume that the thickness is uniform across the dicom image set
         try:
@@ -102,15 +125,51 @@ class Correspondence:
         pixel_space = np.asarray(self.dcm_info[0].PixelSpacing, dtype=np.float64)
 
         voxel_size = np.append(pixel_space, thickness)
-        return voxel_size
+        self.cache['voxel_size'] = voxel_size
+        return voxel_size.copy()
 
-    def find_boundary(self, coor_3d: np.ndarray):
-        coor_3d = coor_3d.transpose()
-        bounds = np.zeros(6)
-        for i in range(coor_3d.shape[0]):
-            bounds[2 * i] = np.floor(np.min(coor_3d[i]))
-            bounds[2 * i + 1] = np.ceil(np.max(coor_3d[i]))
+    def find_boundary(self, coor_3d: np.ndarray) -> np.ndarray:
+        """Find the bounds of 3D coordinates
 
-        bounds = bounds.astype(np.int16)
+        Parameters
+        ----------
+        coor_3d : np.ndarray
+            3D coordinates (shape = (the number of coordinates, 3))
+
+        Returns
+        -------
+        np.ndarray
+            bounds in physical coordinate [xmin, xmax, ymin, ymax, zmin, zmax]
+        """
+        bounds = np.empty(6, dtype=np.float64)
+        bounds[0::2] = np.min(coor_3d, axis=0)
+        bounds[1::2] = np.max(coor_3d, axis=0)
 
         return bounds
+
+    def calculate_bounds(self, shape: Tuple[int, int]) -> np.ndarray:
+        """Calculate the bounds of the volume from its eight corners
+        The corners are the outermost pixels of the first and the last dicom image,
+        so no pixel has to be transformed
+
+        Parameters
+        ----------
+        shape : (int, int)
+            the number of rows and columns of a dicom image
+
+        Returns
+        -------
+        np.ndarray
+            bounds in physical coordinate [xmin, xmax, ymin, ymax, zmin, zmax]
+        """
+        row, col = shape[:2]
+        key = ('bounds', row, col)
+        if key not in self.cache:
+            affine = self.generate_matrices()[[0, -1]]
+            corners = np.asarray([[0, 0], [row - 1, 0], [0, col - 1], [row - 1, col - 1]], dtype=np.float64)
+
+            # (2 dicom images, 4 corners, 3) -> (8, 3)
+            coor_3d = corners @ affine[:, :3, :2].transpose(0, 2, 1) + affine[:, None, :3, 3]
+            self.cache[key] = self.find_boundary(coor_3d.reshape(-1, 3))
+
+        return self.cache[key].copy()
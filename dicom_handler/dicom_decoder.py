@@ -3,7 +3,8 @@ import numpy as np
 import os
 import copy as cp
 import SimpleITK as sitk
-from typing import List
+from typing import List, Tuple, Union
+from job_handler.job import track
 
 
 class DicomDecoder:
@@ -14,6 +15,9 @@ class DicomDecoder:
     However, pydicom reads information in a dicom file better than SimpleITK.
     """
 
+    # pixel data bigger than this size is not loaded while reading information of dicom files
+    DEFER_SIZE = '1 KB'
+
     def __init__(self, dir_path: str) -> None:
         """Initialize the class
 
@@ -32,6 +36,7 @@ class DicomDecoder:
         self.info = None
         self.files = None
         self.imgs = None
+        self.pixel_locs = None
         self.is_hounsfield = False
 
     def read_info(self) -> None:
@@ -41,7 +46,8 @@ class DicomDecoder:
         files = [self.dir_path + s for s in os.listdir(self.dir_path)]
 
         # read information in dicom files
-        info = [pydicom.read_file(s) for s in files]
+        # pixel data is deferred, so that the header scan does not load every image into memory
+        info = [pydicom.dcmread(s, defer_size=self.DEFER_SIZE) for s in track(files, 'reading dicom information')]
 
         # get sorted index based on InstanceNumber of a dicom file
         sorted_ind = sorted(range(len(info)), key=lambda x: int(info[x].InstanceNumber))
@@ -52,12 +58,90 @@ class DicomDecoder:
 
         self.info = info
         self.files = files
+        self.pixel_locs = [self.find_pixel_loc(dcm) for dcm in info]
+
+    @staticmethod
+    def find_pixel_loc(dcm: pydicom.Dataset) -> Union[Tuple[int, np.dtype, Tuple[int, int]], None]:
+        """Find where the raw pixel data of an uncompressed dicom file is stored
+
+        Parameters
+        ----------
+        dcm : pydicom.Dataset
+            dicom information read with deferred pixel data
+
+        Returns
+        -------
+        (int, numpy.dtype, (int, int)) or None
+            byte offset of PixelData in the file, data type of a stored pixel and image shape (row, column)
+            None, if the pixel data can't be read directly (compressed, multi-frame, color, ...)
+        """
+        file_meta = getattr(dcm, 'file_meta', None)
+        syntax = getattr(file_meta, 'TransferSyntaxUID', None)
+        if syntax is None or syntax.is_compressed or syntax.is_deflated:
+            return None
+
+        if int(getattr(dcm, 'SamplesPerPixel', 1)) != 1 or int(getattr(dcm, 'NumberOfFrames', 1) or 1) != 1:
+            return None
+
+        bits = int(getattr(dcm, 'BitsAllocated', 0))
+        if bits not in (8, 16):
+            return None
+
+        if 'PixelData' not in dcm:
+            return None
+        elem = dcm.get_item('PixelData')
+        if getattr(elem, 'is_undefined_length', False) or getattr(elem, 'length', 0) == 0xFFFFFFFF:
+            return None
+
+        # RawDataElement keeps the position of its value in value_tell,
+        # a deferred DataElement keeps the same position in file_tell
+        offset = getattr(elem, 'value_tell', None)
+        if offset is None:
+            offset = getattr(elem, 'file_tell', None)
+        if offset is None:
+            return None
+
+        dtype = np.dtype(('i' if int(dcm.PixelRepresentation) else 'u') + str(bits // 8))
+        dtype = dtype.newbyteorder('<' if syntax.is_little_endian else '>')
+        return offset, dtype, (int(dcm.Rows), int(dcm.Columns))
+
+    def map_pixel_data(self, index: int) -> Union[np.memmap, None]:
+        """Memory-map the stored pixel data of a dicom file without decoding or copying it
+
+        Parameters
+        ----------
+        index : int
+            index of the dicom file, sorted by InstanceNumber
+
+        Returns
+        -------
+        numpy.memmap or None
+            read-only view of the stored pixel values (shape = (row, column))
+            None, if the dicom file is compressed
+        """
+        if self.pixel_locs is None:
+            raise ValueError('dicom information is not read, yet')
+
+        loc = self.pixel_locs[index]
+        if loc is None:
+            return None
+
+        offset, dtype, shape = loc
+        return np.memmap(self.files[index], dtype=dtype, mode='r', offset=offset, shape=shape)
 
     def convert_dcm2img(self) -> None:
         """Decode each dicom file to convert into image
+        Uncompressed dicom files are copied straight from the file into the volume buffer,
+        compressed dicom files are decoded by SimpleITK
         """
+        if self.pixel_locs is not None and all(loc is not None for loc in self.pixel_locs):
+            shapes = {loc[2] for loc in self.pixel_locs}
+            if len(shapes) == 1:
+                self.imgs = self.read_uncompressed(*shapes.pop())
+                return
+
         # read each dicom file to convert into an image
-        self.imgs = [sitk.ReadImage(f) for f in self.files]
+        self.imgs = [sitk.ReadImage(f) for f in track(self.files, 'decoding dicom images')]
         # convert images into array and stack them
         # shape = (dicom image row, dicom image column, the number of dicom images)
         self.imgs = np.stack([np.squeeze(sitk.GetArrayFromImage(img)) for img in self.imgs], axis=2)
@@ -66,6 +150,39 @@ class DicomDecoder:
         # By casting to int16, it can maintain the same data type
         self.imgs = self.imgs.astype(np.int16)
 
+    def read_uncompressed(self, row: int, col: int) -> np.ndarray:
+        """Copy the memory-mapped pixel data of every dicom file into one volume
+
+        Parameters
+        ----------
+        row : int
+            the number of rows in a dicom image
+        col : int
+            the number of columns in a dicom image
+
+        Returns
+        -------
+        numpy.ndarray
+            stacked images (shape = (row, column, the number of dicom images))
+        """
+        # each slice is written contiguously, the volume is exposed with slices on the last axis
+        volume = np.empty((len(self.files), row, col), dtype=np.int16)
+        for index, dcm in track(enumerate(self.info), 'reading dicom images', len(self.info)):
+            pixels = self.map_pixel_data(index)
+
+            # SimpleITK applies the rescale formula while decoding,
+            # so the same values are produced here to keep both paths interchangeable
+            slope = np.float64(getattr(dcm, 'RescaleSlope', 1))
+            intercept = np.float64(getattr(dcm, 'RescaleIntercept', 0))
+            if slope == 1 and intercept == 0:
+                volume[index] = pixels
+            else:
+                volume[index] = slope * pixels + intercept
+
+            del pixels
+
+        return np.moveaxis(volume, 0, 2)
+
     def calculate_hounsfield(self) -> None:
         """Calculate Hounsfield unit (HU)
         """
@@ -108,7 +225,7 @@ class DicomDecoder:
 
         label_loc = []
         len_dcm = imgs.shape[2]
-        for index in range(len_dcm):
+        for index in track(range(len_dcm), 'collecting label location'):
             locs = np.nonzero(imgs[:, :, index])
             # collect non zero (labeled) indexes
             indexes = np.transpose((locs[0], locs[1]))
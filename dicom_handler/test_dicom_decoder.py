@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRBigEndian, ExplicitVRLittleEndian, ImplicitVRLittleEndian, generate_uid
+
+from dicom_handler.dicom_decoder import DicomDecoder
+
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+
+
+def write_series(dir_path: str, imgs: np.ndarray, syntax: str, slope=1., intercept=0.) -> None:
+    """Write a volume as a series of uncompressed dicom files, one file per slice on the last axis
+
+    Parameters
+    ----------
+    dir_path  : str
+        directory path for the dicom files
+    imgs      : np.ndarray
+        stored pixel values (shape = (row, column, the number of dicom images)), int16, uint16 or uint8
+    syntax    : str
+        transfer syntax UID
+    slope     : float
+        rescale slope
+    intercept : float
+        rescale intercept
+    """
+    n_imgs = imgs.shape[2]
+    for index in range(n_imgs):
+        meta = FileMetaDataset()
+        meta.TransferSyntaxUID = syntax
+        meta.MediaStorageSOPClassUID = CT_IMAGE_STORAGE
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+
+        # files are listed in reverse, so the decoder has to sort them by InstanceNumber
+        file_path = os.path.join(dir_path, f'{n_imgs - index:03d}.dcm')
+        ds = FileDataset(file_path, {}, file_meta=meta, preamble=b'\0' * 128)
+        ds.SOPClassUID = meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.InstanceNumber = index + 1
+        ds.PixelSpacing = [0.5, 0.5]
+        ds.SliceThickness = 1.
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.ImagePositionPatient = [0, 0, index]
+        ds.RescaleSlope = slope
+        ds.RescaleIntercept = intercept
+        ds.Rows, ds.Columns = imgs.shape[:2]
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = ds.BitsStored = imgs.dtype.itemsize * 8
+        ds.HighBit = ds.BitsStored - 1
+        ds.PixelRepresentation = int(imgs.dtype.kind == 'i')
+        # the pixel data is written as it is, so it is encoded in the byte order of the transfer syntax here
+        byte_order = '>' if syntax == ExplicitVRBigEndian else '<'
+        ds.PixelData = imgs[:, :, index].astype(imgs.dtype.newbyteorder(byte_order)).tobytes()
+
+        try:
+            # pydicom 3
+            ds.save_as(file_path, enforce_file_format=True)
+        except TypeError:
+            ds.is_little_endian = syntax != ExplicitVRBigEndian
+            ds.is_implicit_VR = syntax == ImplicitVRLittleEndian
+            ds.save_as(file_path, write_like_original=False)
+
+
+def decode(dir_path: str, memory_map: bool) -> np.ndarray:
+    decoder = DicomDecoder(dir_path + os.sep)
+    decoder.read_info()
+    if memory_map:
+        assert all(loc is not None for loc in decoder.pixel_locs)
+    else:
+        # without the pixel locations, every file is decoded by SimpleITK
+        decoder.pixel_locs = None
+    decoder.convert_dcm2img()
+    return decoder.get_imgs()
+
+
+@pytest.mark.parametrize('syntax', [ExplicitVRLittleEndian, ImplicitVRLittleEndian, ExplicitVRBigEndian])
+@pytest.mark.parametrize('dtype, slope, intercept', [
+    (np.int16, 1., 0.),
+    (np.int16, 2., -100.),
+    (np.uint16, 1., -1024.),
+    (np.uint8, 1., 0.)
+])
+def test_memory_map_equals_simpleitk(tmp_path, syntax, dtype, slope, intercept):
+    rng = np.random.default_rng(0)
+    info = np.iinfo(dtype)
+    # stored values small enough to stay in int16 after the rescale
+    imgs = rng.integers(max(info.min, -2000), min(info.max, 2000), size=(6, 7, 5), endpoint=True).astype(dtype)
+    write_series(str(tmp_path), imgs, syntax, slope, intercept)
+
+    mapped = decode(str(tmp_path), memory_map=True)
+    decoded = decode(str(tmp_path), memory_map=False)
+
+    assert mapped.dtype == decoded.dtype == np.int16
+    np.testing.assert_array_equal(mapped, decoded)
+    np.testing.assert_array_equal(mapped, (slope * imgs.astype(np.float64) + intercept).astype(np.int16))
+
+
+def test_pixel_loc_is_none_for_compressed(tmp_path):
+    write_series(str(tmp_path), np.zeros((4, 4, 1), dtype=np.int16), ExplicitVRLittleEndian)
+    dcm = pydicom.dcmread(os.path.join(str(tmp_path), '001.dcm'), defer_size=DicomDecoder.DEFER_SIZE)
+    dcm.file_meta.TransferSyntaxUID = pydicom.uid.JPEGLosslessSV1
+
+    assert DicomDecoder.find_pixel_loc(dcm) is None
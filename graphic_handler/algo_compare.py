@@ -0,0 +1,414 @@
+import csv
+import ctypes
+import multiprocessing as mp
+import os
+import os.path as path
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+import numpy as np
+import pyvista as pv
+import vtk
+from vtk.util import numpy_support
+
+from graphic_handler.graphic_generator import get_vol_algo_dict
+from graphic_handler.graphic_util import save_object
+from graphic_handler.imagedata_generator import describe_volume, downsample_imagedata, setup_imagedata
+from graphic_handler.parallel_util import prefer_smp, set_num_threads, use_num_threads
+from job_handler.job import check
+
+
+def share_imagedata(image_data: vtk.vtkImageData) -> Tuple[shared_memory.SharedMemory, dict]:
+    """Copy the scalars of an image volume into shared memory
+
+    Parameters
+    ----------
+    image_data : vtk.vtkImageData
+        image volume
+
+    Returns
+    -------
+    (shared_memory.SharedMemory, dict)
+        first element  : shared memory holding the scalars (the caller has to close and unlink it)
+        second element : description of the image volume to attach it in another process
+    """
+    scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+
+    shm = shared_memory.SharedMemory(create=True, size=max(scalars.nbytes, 1))
+    shared = np.ndarray(scalars.shape, dtype=scalars.dtype, buffer=shm.buf)
+    shared[:] = scalars
+    del shared
+
+    meta = {
+        'name': shm.name,
+        'shape': scalars.shape,
+        'dtype': scalars.dtype.str,
+        'origin': image_data.GetOrigin(),
+        'spacing': image_data.GetSpacing(),
+        'dim': image_data.GetDimensions()
+    }
+    return shm, meta
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to shared memory created by another process
+    The creating process owns the shared memory, so it is not tracked here if python allows it
+
+    Parameters
+    ----------
+    name : str
+        name of the shared memory
+
+    Returns
+    -------
+    shared_memory.SharedMemory
+        attached shared memory
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13, attaching registers the shared memory again,
+        # which is harmless because worker processes share the resource tracker of the creating process
+        return shared_memory.SharedMemory(name=name)
+
+
+def run_vol_algo(meta: dict, algo: str, output_path: str) -> dict:
+    """Run a surface algorithm on a volume in shared memory and save the mesh
+    The scalars are passed to vtk without copying them
+
+    Parameters
+    ----------
+    meta        : dict
+        description of the image volume from share_imagedata
+    algo        : str
+        name of the surface algorithm in get_vol_algo_dict()
+    output_path : str
+        output file including file path
+
+    Returns
+    -------
+    dict
+        runtime, triangle count and surface area of the mesh, size of the volume and the measured peak memory
+    """
+    # the processes already run in parallel, each algorithm runs as itself on a single thread
+    set_num_threads(1)
+
+    dtype = np.dtype(meta['dtype'])
+    shm = attach_shared_memory(meta['name'])
+    try:
+        scalars = np.ndarray(meta['shape'], dtype=dtype, buffer=shm.buf)
+        base = start_peak_measurement()
+        mesh, runtime = extract_surface(scalars, meta, algo)
+        peak = read_peak(base)
+        save_object(mesh, output_path)
+        n_triangles, surface_area = mesh.n_cells, mesh.area
+        del mesh, scalars
+    finally:
+        shm.close()
+
+    return {
+        'algorithm': algo,
+        'runtime': runtime,
+        'n_triangles': n_triangles,
+        'surface_area': surface_area,
+        'volume_dtype': dtype.name,
+        'volume_mb': int(np.prod(meta['shape'])) * dtype.itemsize / 2 ** 20,
+        'peak_mb': peak,
+        'output': output_path
+    }
+
+
+def extract_surface(scalars: np.ndarray, meta: dict, algo: str) -> Tuple[pv.PolyData, float]:
+    """Extract the surface from the scalars of an image volume without copying them
+
+    Parameters
+    ----------
+    scalars : np.ndarray
+        scalars of the image volume
+    meta    : dict
+        origin, spacing and dim of the image volume (see share_imagedata)
+    algo    : str
+        name of the surface algorithm in get_vol_algo_dict()
+
+    Returns
+    -------
+    (pyvista.PolyData, float)
+        first element  : mesh
+        second element : runtime of the surface algorithm (seconds)
+    """
+    vtk_arr = numpy_support.numpy_to_vtk(num_array=scalars, deep=False)
+    image_data = vtk.vtkImageData()
+    setup_imagedata(image_data, meta['spacing'], meta['origin'], meta['dim'])
+    image_data.GetPointData().SetScalars(vtk_arr)
+
+    start = time.perf_counter()
+    mesh = get_vol_algo_dict()[algo](image_data)
+    runtime = time.perf_counter() - start
+    return mesh, runtime
+
+
+def measure_layouts(image_data: vtk.vtkImageData, algo: str) -> dict:
+    """Measure the peak memory of a surface algorithm on the compact data type of a volume and on float32
+    The volume is copied into each layout, so the copy is part of the peak like a volume held by the pipeline
+
+    Parameters
+    ----------
+    image_data : vtk.vtkImageData
+        image volume
+    algo       : str
+        name of the surface algorithm in get_vol_algo_dict()
+
+    Returns
+    -------
+    dict
+        data type of the volume and the peak memory (MB) of each layout, NaN if it can't be measured
+    """
+    scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+    meta = {'origin': image_data.GetOrigin(), 'spacing': image_data.GetSpacing(),
+            'dim': image_data.GetDimensions()}
+
+    peaks = []
+    for dtype in (scalars.dtype, np.float32):
+        base = start_peak_measurement()
+        mesh, _ = extract_surface(scalars.astype(dtype), meta, algo)
+        del mesh
+        peaks.append(read_peak(base))
+
+    return {'volume_dtype': scalars.dtype.name, 'peak_mb': peaks[0], 'float32_peak_mb': peaks[1]}
+
+
+def start_peak_measurement() -> float:
+    """Start measuring the peak memory of the current process (linux only)
+
+    Returns
+    -------
+    float
+        resident memory (MB) that the peak is measured from, NaN if the peak can't be measured
+    """
+    # freed memory kept by the allocator would hide new allocations
+    trim_memory()
+    if not reset_peak_rss():
+        return float('nan')
+
+    return read_memory_status('VmRSS')
+
+
+def read_peak(base: float) -> float:
+    # peak memory (MB) since start_peak_measurement, NaN if it can't be measured
+    return read_memory_status('VmHWM') - base
+
+
+def trim_memory() -> None:
+    # return freed heap memory to the system (glibc only)
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident memory of the current process (linux only)
+
+    Returns
+    -------
+    bool
+        True, if the peak is reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def read_memory_status(field: str) -> float:
+    """Read a memory field of the current process from /proc/self/status (ex. VmRSS, VmHWM)
+
+    Parameters
+    ----------
+    field : str
+        name of the field
+
+    Returns
+    -------
+    float
+        memory (MB), NaN if it can't be read
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+
+    return float('nan')
+
+
+def compare_vol_algos(volume: vtk.vtkImageData, output_path: str, algos: List[str] = None,
+                      n_workers: int = None) -> List[dict]:
+    """Run surface algorithms on one volume at the same time
+    The volume is placed in shared memory once and every worker process reads it without copying
+
+    Parameters
+    ----------
+    volume        : vtk.vtkImageData
+        prepared (padded) image volume
+    output_path   : str
+        output file including file path, the name of each algorithm is appended to the file name
+        the table of the results is saved next to it with '_compare.csv'
+    algos         : List[str]
+        names of the surface algorithms, every algorithm in get_vol_algo_dict() if it is not given
+    n_workers     : int
+        the number of worker processes, one per algorithm if it is not given
+
+    Returns
+    -------
+    List[dict]
+        runtime, triangle count, surface area and memory usage of each algorithm
+    """
+    if algos is None:
+        algos = list(get_vol_algo_dict().keys())
+
+    if n_workers is None:
+        n_workers = len(algos)
+
+    base, ext = path.splitext(output_path)
+    outputs = [f"{base}_{algo.replace(' ', '_')}{ext}" for algo in algos]
+
+    # the workers write into a temporary directory and the meshes are moved next to the output at the end,
+    # so that a cancelled or failed comparison leaves no mesh behind
+    tmp_dir = tempfile.mkdtemp(prefix='.compare-', dir=path.dirname(path.abspath(output_path)))
+    shm, meta = share_imagedata(volume)
+    try:
+        # vtk doesn't survive fork safely, so the workers are spawned
+        executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn'))
+        try:
+            futures = [executor.submit(run_vol_algo, meta, algo, path.join(tmp_dir, path.basename(output)))
+                       for algo, output in zip(algos, outputs)]
+
+            # the running job is checked while waiting
+            pending = futures
+            while pending:
+                _, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+                check()
+
+            results = [future.result() for future in futures]
+        except BaseException:
+            terminate_executor(executor)
+            raise
+        executor.shutdown()
+
+        for result, output in zip(results, outputs):
+            os.replace(result['output'], output)
+            result['output'] = output
+    finally:
+        shm.close()
+        shm.unlink()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    save_compare_table(results, f'{base}_compare.csv')
+    return results
+
+
+def terminate_executor(executor: ProcessPoolExecutor) -> None:
+    """Stop a process pool without waiting for the running tasks
+    A running task can't be cancelled, so its worker process is terminated
+
+    Parameters
+    ----------
+    executor : ProcessPoolExecutor
+        process pool to stop
+    """
+    if hasattr(executor, 'terminate_workers'):
+        # python 3.14 and later
+        executor.terminate_workers()
+        return
+
+    # the worker processes are only reachable through a private attribute before python 3.14
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+def benchmark_vol_algos(volume: vtk.vtkImageData, algos: List[str] = None, factors=(1, 2, 4),
+                        thread_counts: List[int] = None, repeat=1, measure_memory=False) -> List[dict]:
+    """Measure surface algorithms on one volume at several downsampling levels and numbers of threads
+    The algorithms run one after another in this process, so that every measurement has the whole machine
+
+    Parameters
+    ----------
+    volume         : vtk.vtkImageData
+        prepared (padded) image volume
+    algos          : List[str]
+        names of the surface algorithms, every algorithm in get_vol_algo_dict() if it is not given
+    factors        : Iterable[int]
+        downsampling factors of the volume
+    thread_counts  : List[int]
+        the numbers of threads, a single thread and all cores if it is not given
+    repeat         : int
+        the number of runs of each measurement, the shortest runtime is kept
+    measure_memory : bool
+        measure the peak memory on the compact data type of the volume and on float32 as well (see measure_layouts)
+
+    Returns
+    -------
+    List[dict]
+        size of the volume and the surface (see describe_volume), the number of threads,
+        whether the multithreaded filters ran (see parallel_util.prefer_smp), runtime and triangle count
+        of each measurement, and the peak memory if it is measured
+    """
+    if algos is None:
+        algos = list(get_vol_algo_dict().keys())
+
+    if thread_counts is None:
+        thread_counts = sorted({1, os.cpu_count() or 1})
+
+    results = []
+    for factor in factors:
+        image_data = downsample_imagedata(volume, factor)
+        features = describe_volume(image_data)
+        for n_threads in thread_counts:
+            # the setting of the caller is restored after each measurement
+            with use_num_threads(n_threads):
+                for algo in algos:
+                    runtimes = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        mesh = get_vol_algo_dict()[algo](image_data)
+                        runtimes.append(time.perf_counter() - start)
+
+                    # marching cubes runs as flying edges with more than one thread, so the rows record which one ran
+                    result = dict(algorithm=algo, smp=prefer_smp(), factor=factor, n_threads=n_threads, **features,
+                                  runtime=min(runtimes), n_triangles=mesh.n_cells)
+                    del mesh
+                    # the timed runs have made the one-time allocations of vtk, so they aren't counted
+                    if measure_memory:
+                        result.update(measure_layouts(image_data, algo))
+                    results.append(result)
+
+    return results
+
+
+def save_compare_table(results: List[dict], output_path: str) -> None:
+    """Save the results of compare_vol_algos or benchmark_vol_algos as a csv file
+
+    Parameters
+    ----------
+    results     : List[dict]
+        results of compare_vol_algos or benchmark_vol_algos
+    output_path : str
+        output csv file including file path
+    """
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
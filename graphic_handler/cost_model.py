@@ -0,0 +1,274 @@
+import json
+import os
+import os.path as path
+from typing import List
+
+import numpy as np
+import vtk
+from scipy.optimize import nnls
+
+from graphic_handler.algo_compare import benchmark_vol_algos
+from graphic_handler.imagedata_generator import describe_volume
+from graphic_handler.parallel_util import get_num_threads, prefer_smp
+
+# the cost model is calibrated once per machine
+DEFAULT_MODEL_PATH = path.join(path.expanduser('~'), '.dcm3d', 'cost_model.json')
+# downsampling factors that select_algorithm chooses from
+DOWNSAMPLE_FACTORS = (1, 2, 3, 4)
+# layout of the saved cost model, a model with another layout is calibrated again
+MODEL_VERSION = 2
+# the fit of each algorithm, by whether the multithreaded filters ran (see parallel_util.prefer_smp)
+IMPLEMENTATIONS = {False: 'single-threaded', True: 'multithreaded'}
+
+
+def get_runtime_features(n_voxels: float, label_fraction: float, n_faces: float, n_threads: int) -> np.ndarray:
+    # fixed cost, work on every voxel, on the voxels inside the surface and on the surface,
+    # the parts split across threads are separated, so that the model learns how well each algorithm scales
+    return np.array([1., n_voxels, n_voxels * label_fraction, n_faces, n_voxels / n_threads, n_faces / n_threads],
+                    dtype=np.float64)
+
+
+def get_triangle_features(n_faces: float) -> np.ndarray:
+    return np.array([1., n_faces], dtype=np.float64)
+
+
+def fit_nonnegative(features: np.ndarray, values: np.ndarray) -> List[float]:
+    """Fit non-negative coefficients with least squares
+    Costs never decrease with a bigger volume, so negative coefficients are not allowed
+
+    Parameters
+    ----------
+    features : np.ndarray
+        features of each sample (shape = (the number of samples, the number of features))
+    values   : np.ndarray
+        measured value of each sample
+
+    Returns
+    -------
+    List[float]
+        coefficient of each feature
+    """
+    # the features differ by orders of magnitude, so the columns are scaled before fitting
+    scale = np.abs(features).max(axis=0)
+    scale[scale == 0] = 1
+    coefficients, _ = nnls(features / scale, values)
+    return (coefficients / scale).tolist()
+
+
+def fit_cost_model(samples: List[dict]) -> dict:
+    """Fit the runtime and the triangle count of each surface algorithm
+    Single-threaded and multithreaded runs are fitted separately,
+    because some algorithms switch to another vtk filter with more than one thread
+
+    Parameters
+    ----------
+    samples : List[dict]
+        measurements from algo_compare.benchmark_vol_algos
+
+    Returns
+    -------
+    dict
+        coefficients of each algorithm and implementation, and the measurements they are fitted to
+    """
+    algorithms = {}
+    for algo, smp in dict.fromkeys((sample['algorithm'], sample['smp']) for sample in samples):
+        rows = [sample for sample in samples if sample['algorithm'] == algo and sample['smp'] == smp]
+        runtime_features = np.stack([get_runtime_features(r['n_voxels'], r['label_fraction'], r['n_faces'],
+                                                          r['n_threads'])
+                                     for r in rows])
+        triangle_features = np.stack([get_triangle_features(r['n_faces']) for r in rows])
+        algorithms.setdefault(algo, {})[IMPLEMENTATIONS[smp]] = {
+            'runtime': fit_nonnegative(runtime_features, np.array([r['runtime'] for r in rows])),
+            'triangles': fit_nonnegative(triangle_features, np.array([r['n_triangles'] for r in rows],
+                                                                     dtype=np.float64))
+        }
+
+    return {
+        'version': MODEL_VERSION,
+        'cpu_count': os.cpu_count(),
+        'algorithms': algorithms,
+        'samples': samples
+    }
+
+
+def save_cost_model(model: dict, model_path=DEFAULT_MODEL_PATH) -> None:
+    os.makedirs(path.dirname(path.abspath(model_path)), exist_ok=True)
+    with open(model_path, 'w') as f:
+        json.dump(model, f, indent=2)
+
+
+def load_cost_model(model_path=DEFAULT_MODEL_PATH) -> dict:
+    """Load a cost model calibrated on this machine
+
+    Parameters
+    ----------
+    model_path : str
+        cost model file
+
+    Returns
+    -------
+    dict
+        cost model, None if the file doesn't exist, it has another layout
+        or it was calibrated on a machine with another number of cores
+    """
+    if not path.isfile(model_path):
+        return None
+
+    with open(model_path) as f:
+        model = json.load(f)
+
+    if model.get('version') != MODEL_VERSION or model.get('cpu_count') != os.cpu_count():
+        return None
+
+    return model
+
+
+def calibrate_cost_model(volume: vtk.vtkImageData, model_path=DEFAULT_MODEL_PATH, algos: List[str] = None,
+                         factors=(1, 2, 4), thread_counts: List[int] = None) -> dict:
+    """Measure the surface algorithms on a volume, fit the cost model and save it
+
+    Parameters
+    ----------
+    volume        : vtk.vtkImageData
+        prepared (padded) image volume
+    model_path    : str
+        cost model file, nothing is saved if it is None
+    algos         : List[str]
+        names of the surface algorithms, every algorithm in get_vol_algo_dict() if it is not given
+    factors       : Iterable[int]
+        downsampling factors of the volume to measure
+    thread_counts : List[int]
+        the numbers of threads to measure, a single thread and all cores if it is not given
+
+    Returns
+    -------
+    dict
+        cost model
+    """
+    model = fit_cost_model(benchmark_vol_algos(volume, algos, factors, thread_counts))
+    if model_path is not None:
+        save_cost_model(model, model_path)
+
+    return model
+
+
+def predict_cost(model: dict, algo: str, features: dict, n_threads: int, factor=1, smp: bool = None) -> (float, float):
+    """Predict the runtime and the triangle count of a surface algorithm
+    The fit of the implementation that runs with the given number of threads is used,
+    or the other one if only that was measured
+
+    Parameters
+    ----------
+    model     : dict
+        cost model
+    algo      : str
+        name of the surface algorithm
+    features  : dict
+        size of the volume and the surface at full resolution (see imagedata_generator.describe_volume)
+    n_threads : int
+        the number of threads
+    factor    : int
+        downsampling factor of the volume
+    smp       : bool
+        whether the multithreaded filters run, they do with more than one thread if it is not given
+
+    Returns
+    -------
+    (float, float)
+        first element  : runtime (seconds)
+        second element : the number of triangles
+    """
+    # the number of voxels shrinks with the volume and the surface with its area, the label fraction stays
+    n_voxels = features['n_voxels'] / factor ** 3
+    n_faces = features['n_faces'] / factor ** 2
+
+    if smp is None:
+        smp = n_threads > 1
+
+    fits = model['algorithms'][algo]
+    coefficients = fits.get(IMPLEMENTATIONS[smp]) or next(iter(fits.values()))
+    runtime = float(np.dot(coefficients['runtime'],
+                           get_runtime_features(n_voxels, features['label_fraction'], n_faces, n_threads)))
+    n_triangles = float(np.dot(coefficients['triangles'], get_triangle_features(n_faces)))
+    return runtime, n_triangles
+
+
+def select_algorithm(model: dict, volume: vtk.vtkImageData, n_threads: int = None, time_budget: float = None,
+                     max_triangles: int = None, factors=DOWNSAMPLE_FACTORS) -> dict:
+    """Choose the surface algorithm and the downsampling factor that meet the budget
+    The finest resolution predicted to meet the budget is chosen, with the fastest algorithm at that resolution.
+    If nothing is predicted to meet it, the candidate that exceeds it the least is chosen.
+
+    Parameters
+    ----------
+    model         : dict
+        cost model
+    volume        : vtk.vtkImageData
+        prepared (padded) image volume
+    n_threads     : int
+        the number of threads, the configured number of threads (or all cores) if it is not given
+    time_budget   : float
+        the maximum runtime of surface extraction (seconds), no limit if it is None, spent if it is 0 or less
+    max_triangles : int
+        the maximum number of triangles, no limit if it is None
+    factors       : Iterable[int]
+        downsampling factors to choose from
+
+    Returns
+    -------
+    dict
+        algorithm   : name of the surface algorithm
+        downsample  : downsampling factor
+        runtime     : predicted runtime (seconds)
+        n_triangles : predicted number of triangles
+        reason      : explanation of the choice
+        candidates  : predictions of every candidate
+    """
+    if n_threads is None:
+        n_threads = get_num_threads() or os.cpu_count() or 1
+        # without a configured number of threads, the multithreaded filters run even on a single core
+        smp = prefer_smp()
+    else:
+        smp = n_threads > 1
+
+    features = describe_volume(volume)
+
+    candidates = []
+    for factor in factors:
+        for algo in model['algorithms']:
+            runtime, n_triangles = predict_cost(model, algo, features, n_threads, factor, smp)
+            candidates.append({'algorithm': algo, 'downsample': factor, 'runtime': runtime,
+                               'n_triangles': n_triangles})
+
+    def excess(candidate: dict) -> float:
+        # how far a candidate exceeds the budget, relative to the budget
+        over = 0.
+        if time_budget is not None:
+            # a spent budget is exceeded by every candidate, the fastest one is then chosen
+            over += max(candidate['runtime'] / time_budget - 1, 0.) if time_budget > 0 else float('inf')
+        if max_triangles is not None:
+            over += max(candidate['n_triangles'] / max_triangles - 1, 0.)
+        return over
+
+    fits = [candidate for candidate in candidates if excess(candidate) == 0]
+    limits = []
+    if time_budget is not None:
+        limits.append(f'{time_budget:g} s')
+    if max_triangles is not None:
+        limits.append(f'{max_triangles} triangles')
+    budget = ' and '.join(limits) or 'no budget'
+
+    if not limits:
+        choice = dict(min(fits, key=lambda c: (c['downsample'], c['runtime'])))
+        choice['reason'] = f"no budget is given, {choice['algorithm']} is the fastest algorithm at full resolution"
+    elif fits:
+        choice = dict(min(fits, key=lambda c: (c['downsample'], c['runtime'])))
+        choice['reason'] = (f"1/{choice['downsample']} resolution is the finest one predicted to meet {budget}, "
+                            f"{choice['algorithm']} is the fastest algorithm at this resolution")
+    else:
+        choice = dict(min(candidates, key=lambda c: (excess(c), c['runtime'])))
+        choice['reason'] = (f"no candidate is predicted to meet {budget}, "
+                            f"{choice['algorithm']} at 1/{choice['downsample']} resolution exceeds it the least")
+
+    choice['candidates'] = candidates
+    return choice
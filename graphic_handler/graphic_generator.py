@@ -1,6 +1,9 @@
 from PVGeo.filters import VoxelizePoints
+from graphic_handler import mesh_reconstructor
 from graphic_handler.mesh_reconstructor import *
 from graphic_handler.imagedata_generator import *
+from graphic_handler.parallel_util import use_num_threads
+from job_handler.job import update_filter
 
 
 def generate_pointcloud(points: np.ndarray) -> pv.PolyData:
@@ -44,15 +47,14 @@ def generate_voxel(points: np.ndarray, voxel_size: np.ndarray) -> pv.Unstructure
     return voxels
 
 
-def convert_pcd2mesh(point_cloud: pv.PolyData) -> pv.PolyData:
-    mesh = convert_pcd2mesh(point_cloud)
+def convert_pcd2mesh(point_cloud: pv.PolyData, alpha=0.) -> pv.PolyData:
+    mesh = mesh_reconstructor.convert_pcd2mesh(point_cloud, alpha=alpha)
     return mesh
 
 
-def convert_voxel2mesh(voxels: pv.UnstructuredGrid, voxel_size: np.ndarray, algo: str, combine_img=False, imgs=None,
-                       smooth=False) -> pv.PolyData:
-    algorithm = get_vol_algo_dict()
-
+def prepare_voxel_volume(voxels: pv.UnstructuredGrid, voxel_size: np.ndarray, combine_img=False, imgs=None,
+                         smooth=False, sigma=None, min_voxels=0, min_volume=0., keep_largest=None,
+                         downsample_sigma=None, bounds=None) -> vtk.vtkImageData:
     if type(voxels).__name__ == 'UnstructuredGrid':
         polydata = convert_voxel2polydata(voxels)
     elif type(voxels).__name__ == 'PolyData':
@@ -61,34 +63,74 @@ def convert_voxel2mesh(voxels: pv.UnstructuredGrid, voxel_size: np.ndarray, algo
         assert f'{type(voxels)} has to be either UnstructuredGrid or PolyData'
 
     if combine_img:
-        image_data = create_imagedata(imgs, voxel_size)
+        # the images are placed by their bounds, so that the voxels select the same region of them
+        if imgs is None or bounds is None:
+            raise ValueError('combining images needs both the images and their bounds')
+        image_data = create_imagedata((np.asarray(imgs).astype(HU_DTYPE, copy=False), bounds), voxel_size)
+        # a voxel is centred half a voxel above its pixel (see calculate_voxel_center), so each pixel lies on
+        # the low faces of its voxel and the stencil would drop it, the stencil is built from the voxels
+        # centred on their pixels instead
+        polydata = polydata.translate(-np.asarray(voxel_size) / 2, inplace=False)
     else:
         image_data = create_imagedata(polydata, voxel_size)
 
-    if smooth:
+    if sigma is not None:
+        image_data = smooth_image_gauss_mm(image_data, sigma, voxel_size, downsample_sigma=downsample_sigma)
+    elif smooth:
         image_data = smooth_image_gauss(image_data)
 
     volume = combine_img_poly(image_data, polydata)
+    if min_voxels or min_volume or keep_largest is not None:
+        volume = remove_small_components_imagedata(volume, min_voxels, min_volume, keep_largest)
+
     volume_pad = pad_imagedata(volume)
-    mesh = algorithm[algo](volume_pad)
-    return mesh
+    return volume_pad
+
 
+def prepare_img_volume(imgs: np.ndarray, bounds, size, smooth=False, sigma=None, min_voxels=0, min_volume=0.,
+                       keep_largest=None, downsample_sigma=None) -> vtk.vtkImageData:
+    # drop small islands of the label before any later stage works on them
+    if min_voxels or min_volume or keep_largest is not None:
+        imgs = remove_small_components(imgs, size, min_voxels, min_volume, keep_largest)
 
-def convert_img2mesh(imgs: np.ndarray, bounds, size, algo: str, smooth=False) -> pv.PolyData:
-    data = (imgs, bounds)
-    algorithm = get_vol_algo_dict()
+    # Hounsfield unit fits in int16, the volume keeps this type through every filter
+    data = (np.asarray(imgs).astype(HU_DTYPE, copy=False), bounds)
     volume = create_imagedata(data, size)
-    if smooth:
+    if sigma is not None:
+        volume = smooth_image_gauss_mm(volume, sigma, size, downsample_sigma=downsample_sigma)
+    elif smooth:
         volume = smooth_image_gauss(volume)
     volume_pad = pad_imagedata(volume)
-    mesh = algorithm[algo](volume_pad)
+    return volume_pad
+
+
+def convert_voxel2mesh(voxels: pv.UnstructuredGrid, voxel_size: np.ndarray, algo: str, combine_img=False, imgs=None,
+                       smooth=False, sigma=None, min_voxels=0, min_volume=0., keep_largest=None,
+                       n_threads=None, downsample_sigma=None, bounds=None) -> pv.PolyData:
+    # n_threads applies to this call only
+    with use_num_threads(n_threads):
+        algorithm = get_vol_algo_dict()
+        volume_pad = prepare_voxel_volume(voxels, voxel_size, combine_img, imgs, smooth, sigma, min_voxels,
+                                          min_volume, keep_largest, downsample_sigma, bounds)
+        mesh = algorithm[algo](volume_pad)
+    return mesh
+
+
+def convert_img2mesh(imgs: np.ndarray, bounds, size, algo: str, smooth=False, sigma=None, min_voxels=0,
+                     min_volume=0., keep_largest=None, n_threads=None, downsample_sigma=None) -> pv.PolyData:
+    # n_threads applies to this call only
+    with use_num_threads(n_threads):
+        algorithm = get_vol_algo_dict()
+        volume_pad = prepare_img_volume(imgs, bounds, size, smooth, sigma, min_voxels, min_volume, keep_largest,
+                                        downsample_sigma)
+        mesh = algorithm[algo](volume_pad)
     return mesh
 
 
 def convert_voxel2polydata(voxels: pv.UnstructuredGrid) -> pv.PolyData:
     geo_filter = vtk.vtkGeometryFilter()
     geo_filter.SetInputData(voxels)
-    geo_filter.Update()
+    update_filter(geo_filter, 'extracting voxel surface')
     polydata = geo_filter.GetOutput()
     polydata_pv = pv.wrap(polydata)
     return polydata_pv
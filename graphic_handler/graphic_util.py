@@ -1,8 +1,12 @@
 from typing import Union
 
+import os
 import os.path as path
 import pyvista as pv
 import vtk
+from graphic_handler.mesh_exporter import export_mesh
+from graphic_handler.parallel_util import configure_filter
+from job_handler.job import update_filter
 
 
 def show_obj(file_path, turning=False, output_path=''):
@@ -34,12 +38,24 @@ def count_voxel(voxel: pv.UnstructuredGrid) -> int:
 
 
 def smooth_mesh_laplacian(mesh: pv.PolyData, n_iter=20) -> pv.PolyData:
-    mesh = mesh.smooth(n_iter=n_iter)
+    # vtkSmoothPolyDataFilter with the settings of pyvista's smooth, so that its progress can be reported
+    smoother = vtk.vtkSmoothPolyDataFilter()
+    smoother.SetInputData(mesh)
+    smoother.SetNumberOfIterations(n_iter)
+    smoother.SetConvergence(0.)
+    smoother.SetRelaxationFactor(0.01)
+    smoother.SetFeatureAngle(45.)
+    smoother.SetEdgeAngle(15.)
+    smoother.FeatureEdgeSmoothingOff()
+    smoother.BoundarySmoothingOn()
+    update_filter(smoother, 'laplacian smoothing')
+    mesh = pv.wrap(smoother.GetOutput())
     return mesh
 
 
 def smooth_mesh(mesh: Union[vtk.vtkPolyData, pv.PolyData], n_iter=15, pass_band=0.001, feature_angle=120.0):
     smoother = vtk.vtkWindowedSincPolyDataFilter()
+    configure_filter(smoother)
     smoother.SetInputData(mesh)
     smoother.SetNumberOfIterations(n_iter)
     smoother.BoundarySmoothingOff()
@@ -48,11 +64,35 @@ def smooth_mesh(mesh: Union[vtk.vtkPolyData, pv.PolyData], n_iter=15, pass_band=
     smoother.SetPassBand(pass_band)
     smoother.NonManifoldSmoothingOn()
     smoother.NormalizeCoordinatesOn()
-    smoother.Update()
+    update_filter(smoother, 'windowed sinc smoothing')
     mesh = smoother.GetOutput()
     mesh = pv.wrap(mesh)
     return mesh
 
 
-def save_object(mesh, output_name: str):
-    mesh.save(output_name)
+def save_object(mesh, output_name: str, quantize=False, oct_normals=False, report=False):
+    base, ext = path.splitext(output_name)
+    # the mesh is written to a temporary file and renamed at the end,
+    # so that a cancelled or failed job doesn't leave a partial output behind
+    tmp_name = f'{base}.partial{ext}'
+    try:
+        write_object(mesh, tmp_name, quantize, oct_normals, report, output_name)
+        os.replace(tmp_name, output_name)
+    except BaseException:
+        if path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+def write_object(mesh, file_name: str, quantize: bool, oct_normals: bool, report: bool, output_name: str):
+    _, ext = path.splitext(file_name)
+    if ext in ('.glb', '.ply') and isinstance(mesh, vtk.vtkPolyData):
+        result = export_mesh(mesh, file_name, quantize=quantize, oct_normals=oct_normals, compare_legacy=report)
+        if report:
+            print(f"\n{output_name}: {result['bytes'] / 2 ** 20:.1f} MB in {result['seconds']:.2f} s "
+                  f"(legacy vtk: {result['legacy_bytes'] / 2 ** 20:.1f} MB in {result['legacy_seconds']:.2f} s, "
+                  f"saved {(result['legacy_bytes'] - result['bytes']) / 2 ** 20:.1f} MB and "
+                  f"{result['legacy_seconds'] - result['seconds']:.2f} s)")
+        return
+
+    mesh.save(file_name)
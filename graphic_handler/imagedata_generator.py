@@ -3,16 +3,38 @@ import vtk
 import pyvista as pv
 import numpy as np
 import math
+from scipy import ndimage
 from typing import Union
+from graphic_handler.parallel_util import configure_filter
+from job_handler.job import update_filter
 
 
-def set_arr2imagedata(image_data: vtk.vtkImageData, imgs: np.ndarray, vtk_type='f'):
-    if vtk_type == 'f':
-        arr_type = vtk.VTK_FLOAT
-    elif vtk_type == 'uc':
-        arr_type = vtk.VTK_UNSIGNED_CHAR
+# dtype policy of volumes
+# binary labels travel as uint8 (0 or LABEL_VALUE) and Hounsfield unit as int16,
+# float is used only where a filter really produces fractions
+LABEL_DTYPE = np.uint8
+LABEL_VALUE = 255
+HU_DTYPE = np.int16
+
+VTK_TYPES = {
+    'f': vtk.VTK_FLOAT,
+    'uc': vtk.VTK_UNSIGNED_CHAR,
+    's': vtk.VTK_SHORT
+}
+
+
+def set_arr2imagedata(image_data: vtk.vtkImageData, imgs: np.ndarray, vtk_type=None):
+    if imgs.dtype == bool:
+        imgs = imgs.astype(LABEL_DTYPE) * LABEL_VALUE
+
+    if vtk_type is None:
+        # keep the data type of the array
+        arr_type = numpy_support.get_vtk_array_type(imgs.dtype)
+    elif vtk_type in VTK_TYPES:
+        arr_type = VTK_TYPES[vtk_type]
     else:
-        assert "With given choices, arr type has to be either float ('f') or unsigned char ('uc')"
+        raise ValueError(f"arr type has to be either float ('f'), unsigned char ('uc') or short ('s'), "
+                         f"but {vtk_type} is given")
 
     vtk_data_arr = numpy_support.numpy_to_vtk(
         num_array=imgs.ravel(order='F'),
@@ -68,13 +90,11 @@ def create_imagedata(data: Union[tuple, vtk.vtkPolyData, pv.PolyData], size: Uni
 
         setup_imagedata(white_image, size, bounds, dim)
 
-        white_image.AllocateScalars(vtk.VTK_FLOAT, 1)
+        white_image.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
 
         # marking 3d points in vtkimagedata
-        inval = 255
-
-        for i in range(white_image.GetNumberOfPoints()):
-            white_image.GetPointData().GetScalars().SetTuple1(i, inval)
+        # the numpy array shares the memory of the vtk array
+        numpy_support.vtk_to_numpy(white_image.GetPointData().GetScalars())[:] = LABEL_VALUE
 
     elif isinstance(data, tuple) and isinstance(data[0], np.ndarray) and (
             isinstance(data[1], np.ndarray) or isinstance(data[1], list)):
@@ -93,12 +113,322 @@ def create_imagedata(data: Union[tuple, vtk.vtkPolyData, pv.PolyData], size: Uni
 
 def smooth_image_gauss(image_data: vtk.vtkImageData, deviation=8.):
     gaussianSmoothFilter = vtk.vtkImageGaussianSmooth()
+    configure_filter(gaussianSmoothFilter)
     gaussianSmoothFilter.SetInputData(image_data)
     gaussianSmoothFilter.SetStandardDeviation(deviation)
-    gaussianSmoothFilter.Update()
+    update_filter(gaussianSmoothFilter, 'gaussian smoothing')
     return gaussianSmoothFilter.GetOutput()
 
 
+def smooth_image_gauss_mm(image_data: vtk.vtkImageData, sigma: Union[float, list, np.ndarray] = 1.,
+                          voxel_size: Union[list, np.ndarray] = None, radius_factor=3., downsample_sigma=None,
+                          compact=True) -> vtk.vtkImageData:
+    """Smooth an image volume with a gaussian kernel whose standard deviation is given in millimetres
+    The standard deviation is converted into voxels per axis, so anisotropic voxels are smoothed correctly.
+    vtkImageGaussianSmooth is separable and splits the volume into pieces for each thread.
+
+    Parameters
+    ----------
+    image_data       : vtk.vtkImageData
+        image volume
+    sigma            : float or list or np.ndarray
+        standard deviation in millimetres, either one value or one value per axis
+    voxel_size       : list or np.ndarray
+        size of a voxel (ex. Correspondence.calculate_voxel_size())
+        the spacing of the image volume is used if it is not given
+    radius_factor    : float
+        the kernel is cut off at radius_factor * standard deviation
+    downsample_sigma : float
+        if the standard deviation of an axis is at least this many voxels,
+        the volume is shrunk along the axis before smoothing and resampled back after it
+    compact          : bool
+        cast a float volume to short before smoothing (label and HU volumes hold integer values)
+
+    Returns
+    -------
+    vtk.vtkImageData
+        smoothed image volume that has the same geometry as the input
+    """
+    spacing = np.asarray(image_data.GetSpacing() if voxel_size is None else voxel_size, dtype=np.float64)
+    sigma_vox = np.broadcast_to(np.asarray(sigma, dtype=np.float64), (3,)) / spacing
+
+    if compact and image_data.GetScalarType() in (vtk.VTK_FLOAT, vtk.VTK_DOUBLE):
+        caster = vtk.vtkImageCast()
+        configure_filter(caster)
+        caster.SetInputData(image_data)
+        caster.SetOutputScalarTypeToShort()
+        caster.ClampOverflowOn()
+        update_filter(caster, 'casting volume')
+        image_data = caster.GetOutput()
+
+    shrink = np.ones(3, dtype=int)
+    if downsample_sigma is not None:
+        shrink = np.maximum(1, np.floor(sigma_vox / downsample_sigma)).astype(int)
+
+    source = image_data
+    if np.any(shrink > 1):
+        # averaging works as a box pre-filter, the remaining smoothing is done on the small volume
+        source = shrink_imagedata(image_data, shrink)
+        sigma_vox = sigma_vox / shrink
+
+    gaussianSmoothFilter = vtk.vtkImageGaussianSmooth()
+    configure_filter(gaussianSmoothFilter)
+    gaussianSmoothFilter.SetInputData(source)
+    gaussianSmoothFilter.SetDimensionality(3)
+    gaussianSmoothFilter.SetStandardDeviations(*sigma_vox.tolist())
+    gaussianSmoothFilter.SetRadiusFactors(radius_factor, radius_factor, radius_factor)
+    update_filter(gaussianSmoothFilter, 'gaussian smoothing')
+    smoothed = gaussianSmoothFilter.GetOutput()
+
+    if np.any(shrink > 1):
+        # resample back onto the original grid
+        reslice = vtk.vtkImageReslice()
+        configure_filter(reslice)
+        reslice.SetInputData(smoothed)
+        reslice.SetOutputOrigin(image_data.GetOrigin())
+        reslice.SetOutputSpacing(image_data.GetSpacing())
+        reslice.SetOutputExtent(image_data.GetExtent())
+        reslice.SetInterpolationModeToLinear()
+        # the first and the last half block lie outside the centres of the shrunk voxels,
+        # mirroring extends the edge instead of filling it with 0
+        reslice.MirrorOn()
+        update_filter(reslice, 'resampling volume')
+        smoothed = reslice.GetOutput()
+
+    return smoothed
+
+
+def shrink_imagedata(image_data: vtk.vtkImageData, factors: Union[int, list, np.ndarray]) -> vtk.vtkImageData:
+    """Shrink an image volume by averaging blocks of voxels
+    The volume is mirrored at its far end up to a whole number of blocks, so that no voxel is dropped,
+    and the origin is moved to the centre of the first block, so that the shrunk volume stays in place
+
+    Parameters
+    ----------
+    image_data : vtk.vtkImageData
+        image volume
+    factors    : int or list or np.ndarray
+        the number of voxels merged into one, either one value or one value per axis
+
+    Returns
+    -------
+    vtk.vtkImageData
+        shrunk image volume
+    """
+    factors = np.broadcast_to(np.asarray(factors, dtype=int), (3,))
+    extent = np.asarray(image_data.GetExtent())
+    dim = extent[1::2] - extent[0::2] + 1
+    dim_pad = -(-dim // factors) * factors
+
+    source = image_data
+    if np.any(dim_pad > dim):
+        extent_pad = extent.copy()
+        extent_pad[1::2] = extent[0::2] + dim_pad - 1
+
+        mirror = vtk.vtkImageMirrorPad()
+        configure_filter(mirror)
+        mirror.SetInputData(image_data)
+        mirror.SetOutputWholeExtent(*extent_pad.tolist())
+        update_filter(mirror, 'padding volume')
+        source = mirror.GetOutput()
+
+    shrinker = vtk.vtkImageShrink3D()
+    configure_filter(shrinker)
+    shrinker.SetInputData(source)
+    shrinker.SetShrinkFactors(*factors.tolist())
+    shrinker.AveragingOn()
+    update_filter(shrinker, 'shrinking volume')
+
+    # vtkImageShrink3D keeps the origin of the input, but a shrunk voxel is the average of a whole block
+    shrunk = vtk.vtkImageData()
+    shrunk.ShallowCopy(shrinker.GetOutput())
+    shrunk.SetOrigin(np.asarray(image_data.GetOrigin()) + (factors - 1) / 2 * np.asarray(image_data.GetSpacing()))
+    return shrunk
+
+
+def downsample_imagedata(image_data: vtk.vtkImageData, factor=1, iso_value=1) -> vtk.vtkImageData:
+    """Shrink a prepared (padded) image volume by merging blocks of voxels
+    A merged voxel is inside the surface if at least half of its block is, so that the surface stays in place,
+    and the shrunk volume is padded again, so that the surface stays closed
+
+    Parameters
+    ----------
+    image_data : vtk.vtkImageData
+        prepared (padded) image volume
+    factor     : int
+        the number of voxels along each axis merged into one, the volume is returned as it is if it is 1
+    iso_value  : float
+        voxels at or above this value are inside the surface
+
+    Returns
+    -------
+    vtk.vtkImageData
+        downsampled label volume (LABEL_DTYPE, 0 or LABEL_VALUE) that covers the same region
+    """
+    if factor < 1:
+        raise ValueError(f'the downsampling factor has to be positive, but {factor} is given')
+
+    if factor == 1:
+        return image_data
+
+    # averaging the values themselves would spread the surface over every block that touches it,
+    # so the fraction of each block inside the surface is averaged instead
+    scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+    label = vtk.vtkImageData()
+    label.CopyStructure(image_data)
+    label.GetPointData().SetScalars(numpy_support.numpy_to_vtk(
+        num_array=np.where(scalars >= iso_value, LABEL_VALUE, 0).astype(LABEL_DTYPE), deep=True))
+
+    shrunk = shrink_imagedata(label, factor)
+    shrunk_arr = numpy_support.vtk_to_numpy(shrunk.GetPointData().GetScalars())
+    shrunk.GetPointData().SetScalars(numpy_support.numpy_to_vtk(
+        num_array=np.where(shrunk_arr >= LABEL_VALUE / 2, LABEL_VALUE, 0).astype(LABEL_DTYPE), deep=True))
+
+    # the blocks at the border are averaged with the padding, so the shrunk volume is padded again
+    return pad_imagedata(shrunk)
+
+
+def describe_volume(image_data: vtk.vtkImageData, iso_value=1) -> dict:
+    """Measure the size of an image volume and of the surface in it
+
+    Parameters
+    ----------
+    image_data : vtk.vtkImageData
+        image volume
+    iso_value  : float
+        voxels at or above this value are inside the surface
+
+    Returns
+    -------
+    dict
+        n_voxels       : the number of voxels
+        label_fraction : fraction of voxels inside the surface
+        n_faces        : the number of faces between a voxel inside and a voxel outside,
+                         which is proportional to the number of triangles of the surface
+    """
+    dim = image_data.GetDimensions()
+    scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+    mask = scalars.reshape(dim, order='F') >= iso_value
+
+    n_faces = sum(int(np.count_nonzero(np.diff(mask, axis=axis))) for axis in range(3))
+    return {
+        'n_voxels': int(mask.size),
+        'label_fraction': float(np.count_nonzero(mask)) / max(mask.size, 1),
+        'n_faces': n_faces
+    }
+
+
+def filter_components(mask: np.ndarray, min_voxels=0, keep_largest=None, connectivity=26) -> np.ndarray:
+    """Find the connected components of a mask to keep
+
+    Parameters
+    ----------
+    mask         : np.ndarray
+        3D boolean mask
+    min_voxels   : int
+        components smaller than this number of voxels are dropped
+    keep_largest : int
+        only this many largest components are kept, every component is kept if it is None
+    connectivity : int
+        neighbourhood of a voxel, either 6, 18 or 26
+
+    Returns
+    -------
+    np.ndarray
+        3D boolean mask of the kept components
+    """
+    if connectivity not in (6, 18, 26):
+        raise ValueError(f'connectivity has to be either 6, 18 or 26, but {connectivity} is given')
+
+    structure = ndimage.generate_binary_structure(3, {6: 1, 18: 2, 26: 3}[connectivity])
+    labels, n_labels = ndimage.label(mask, structure=structure)
+    if n_labels == 0:
+        return mask.astype(bool)
+
+    # sizes[0] is the background
+    sizes = np.bincount(labels.ravel())
+    keep = sizes >= min_voxels
+    keep[0] = False
+
+    if keep_largest is not None:
+        largest = np.zeros_like(keep)
+        largest[np.argsort(sizes[1:])[::-1][:keep_largest] + 1] = True
+        keep &= largest
+
+    return keep[labels]
+
+
+def remove_small_components(imgs: np.ndarray, voxel_size: Union[list, np.ndarray] = None, min_voxels=0,
+                            min_volume=0., keep_largest=None, connectivity=26) -> np.ndarray:
+    """Remove small connected components of the labeled voxels (value > 0)
+    Removed voxels are set to 0, so surface algorithms don't create islands for them
+
+    Parameters
+    ----------
+    imgs         : np.ndarray
+        3D volume
+    voxel_size   : list or np.ndarray
+        size of a voxel (mm), needed only for min_volume
+    min_voxels   : int
+        components smaller than this number of voxels are removed
+    min_volume   : float
+        components smaller than this volume (mm^3) are removed
+    keep_largest : int
+        only this many largest components are kept, every component is kept if it is None
+    connectivity : int
+        neighbourhood of a voxel, either 6, 18 or 26
+
+    Returns
+    -------
+    np.ndarray
+        volume without the removed components
+    """
+    if min_volume:
+        if voxel_size is None:
+            raise ValueError('voxel size is needed to remove components by volume')
+        min_voxels = max(min_voxels, int(math.ceil(min_volume / np.prod(voxel_size))))
+
+    keep = filter_components(imgs > 0, min_voxels, keep_largest, connectivity)
+    imgs = imgs.copy()
+    imgs[(imgs > 0) & ~keep] = 0
+    return imgs
+
+
+def remove_small_components_imagedata(image_data: vtk.vtkImageData, min_voxels=0, min_volume=0., keep_largest=None,
+                                      connectivity=26) -> vtk.vtkImageData:
+    """Remove small connected components of the labeled voxels (value > 0) in vtkImageData
+
+    Parameters
+    ----------
+    image_data   : vtk.vtkImageData
+        image volume
+    min_voxels   : int
+        components smaller than this number of voxels are removed
+    min_volume   : float
+        components smaller than this volume (mm^3) are removed, the spacing is regarded as the voxel size
+    keep_largest : int
+        only this many largest components are kept, every component is kept if it is None
+    connectivity : int
+        neighbourhood of a voxel, either 6, 18 or 26
+
+    Returns
+    -------
+    vtk.vtkImageData
+        image volume without the removed components
+    """
+    dim = image_data.GetDimensions()
+    image_arr = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars()).reshape(dim, order='F')
+    image_arr = remove_small_components(image_arr, image_data.GetSpacing(), min_voxels, min_volume, keep_largest,
+                                        connectivity)
+
+    filtered = vtk.vtkImageData()
+    filtered.CopyStructure(image_data)
+    vtk_data_arr = numpy_support.numpy_to_vtk(num_array=image_arr.ravel(order='F'), deep=True,
+                                              array_type=image_data.GetScalarType())
+    filtered.GetPointData().SetScalars(vtk_data_arr)
+    return filtered
+
+
 def combine_img_poly(image_data: vtk.vtkImageData, polydata: Union[pv.PolyData, vtk.vtkPolyData]) -> vtk.vtkImageData:
     origin = image_data.GetOrigin()
     spacing = image_data.GetSpacing()
@@ -106,29 +436,30 @@ def combine_img_poly(image_data: vtk.vtkImageData, polydata: Union[pv.PolyData,
 
     # from polydata to image volume
     pol2stenc = vtk.vtkPolyDataToImageStencil()
+    configure_filter(pol2stenc)
     pol2stenc.SetInputData(polydata)
 
     pol2stenc.SetOutputOrigin(origin)
     pol2stenc.SetOutputSpacing(spacing)
     pol2stenc.SetOutputWholeExtent(image_data.GetExtent())
-    pol2stenc.Update()
+    update_filter(pol2stenc, 'creating stencil')
 
     imgstenc = vtk.vtkImageStencil()
+    configure_filter(imgstenc)
     imgstenc.SetInputData(image_data)
     imgstenc.SetStencilConnection(pol2stenc.GetOutputPort())
     imgstenc.ReverseStencilOff()
     imgstenc.SetBackgroundValue(outval)
-    imgstenc.Update()
+    update_filter(imgstenc, 'applying stencil')
 
     return imgstenc.GetOutput()
 
 
 def pad_imagedata(orig_image_data: vtk.vtkImageData) -> vtk.vtkImageData:
     image_data = vtk.vtkImageData()
-    image_data.DeepCopy(orig_image_data)
 
-    dim = image_data.GetDimensions()
-    point_data = image_data.GetPointData()
+    dim = orig_image_data.GetDimensions()
+    point_data = orig_image_data.GetPointData()
     # Ensure that only one array exists within the 'vtkPointData' object
     assert (point_data.GetNumberOfArrays() == 1)
     # Get the `vtkArray` (or whatever derived type) which is needed for the `numpy_support.vtk_to_numpy` function
@@ -136,21 +467,84 @@ def pad_imagedata(orig_image_data: vtk.vtkImageData) -> vtk.vtkImageData:
 
     # Convert the `vtkArray` to a NumPy array
     image_arr = numpy_support.vtk_to_numpy(point_arr)
-    # Reshape the NumPy array to 3D using 'ConstPixelDims' as a 'shape'
-    image_arr = image_arr.reshape(dim, order='F')
-
-    zero_pad = np.zeros((dim[0], dim[1], 1))
-    image_arr = np.concatenate((zero_pad, image_arr, zero_pad), axis=2)
 
-    dim_pad = image_arr.shape
-
-    origin = image_data.GetOrigin()
-    spacing = image_data.GetSpacing()
-    origin_update = [origin[0], origin[1], origin[2]]
-    origin_update[2] -= spacing[2]
+    # in vtk (fortran) order, a slice along the last axis is a contiguous block,
+    # so padding slices is writing the volume between two zero blocks of the same data type
+    dim_pad = (dim[0], dim[1], dim[2] + 2)
+    slab = dim[0] * dim[1]
+    pad_arr = numpy_support.create_vtk_array(point_arr.GetDataType())
+    pad_arr.SetNumberOfComponents(1)
+    pad_arr.SetNumberOfTuples(slab * dim_pad[2])
+    pad_view = numpy_support.vtk_to_numpy(pad_arr)
+    pad_view[:slab] = 0
+    pad_view[slab:slab + image_arr.size] = image_arr
+    pad_view[slab + image_arr.size:] = 0
+
+    # the first slice of the padded volume is one slice below the first slice of the volume
+    spacing = orig_image_data.GetSpacing()
+    origin = list(orig_image_data.GetOrigin())
+    origin[2] -= spacing[2]
 
     setup_imagedata(image_data, spacing, origin, dim_pad)
     image_data.ComputeBounds()
 
-    set_arr2imagedata(image_data, image_arr)
+    image_data.GetPointData().SetScalars(pad_arr)
+    return image_data
+
+
+def pack_imagedata(image_data: vtk.vtkImageData) -> dict:
+    """Convert vtkImageData into a picklable dictionary
+    Binary labels (0 or one value in uint8) are bit-packed
+
+    Parameters
+    ----------
+    image_data : vtk.vtkImageData
+        image volume
+
+    Returns
+    -------
+    dict
+        geometry and scalars of the image volume
+    """
+    scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+    packed = {
+        'origin': image_data.GetOrigin(),
+        'spacing': image_data.GetSpacing(),
+        'dim': image_data.GetDimensions(),
+        'dtype': scalars.dtype.str,
+        'size': scalars.size
+    }
+
+    value = scalars.max() if scalars.size else 0
+    if scalars.dtype == LABEL_DTYPE and np.all((scalars == 0) | (scalars == value)):
+        packed['bits'] = np.packbits(scalars != 0)
+        packed['value'] = int(value)
+    else:
+        packed['scalars'] = scalars.copy()
+
+    return packed
+
+
+def unpack_imagedata(packed: dict) -> vtk.vtkImageData:
+    """Restore vtkImageData from pack_imagedata
+
+    Parameters
+    ----------
+    packed : dict
+        geometry and scalars of the image volume
+
+    Returns
+    -------
+    vtk.vtkImageData
+        image volume
+    """
+    if 'bits' in packed:
+        scalars = np.unpackbits(packed['bits'], count=packed['size']).astype(np.dtype(packed['dtype']))
+        scalars *= packed['value']
+    else:
+        scalars = packed['scalars']
+
+    image_data = vtk.vtkImageData()
+    setup_imagedata(image_data, packed['spacing'], packed['origin'], packed['dim'])
+    image_data.GetPointData().SetScalars(numpy_support.numpy_to_vtk(num_array=scalars, deep=True))
     return image_data
@@ -0,0 +1,380 @@
+import json
+import os
+import os.path as path
+import struct
+import tempfile
+import time
+from typing import Tuple, Union
+
+import numpy as np
+import pyvista as pv
+
+from graphic_handler.mesh_smoother import get_triangles
+
+# the number of vertices or triangles converted and written at once
+CHUNK_SIZE = 1 << 20
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON = 0x4E4F534A
+GLB_BIN = 0x004E4942
+
+GL_SHORT = 5122
+GL_UNSIGNED_SHORT = 5123
+GL_UNSIGNED_INT = 5125
+GL_FLOAT = 5126
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+
+
+def get_mesh_arrays(mesh: pv.PolyData) -> Tuple[np.ndarray, np.ndarray, Union[np.ndarray, None]]:
+    """Return vertices, triangles and vertex normals of a mesh as numpy arrays
+
+    Parameters
+    ----------
+    mesh : pyvista.PolyData
+        mesh object
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray, np.ndarray or None)
+        first element  : vertex coordinates (shape = (the number of vertices, 3))
+        second element : vertex indices of each triangle (shape = (the number of triangles, 3))
+        third element  : vertex normals (shape = (the number of vertices, 3)), None if the mesh has no normals
+    """
+    if not isinstance(mesh, pv.PolyData):
+        mesh = pv.wrap(mesh)
+
+    points = np.asarray(mesh.points, dtype=np.float32)
+    triangles = np.asarray(get_triangles(mesh), dtype=np.uint32)
+
+    normals = None
+    if 'Normals' in mesh.point_data:
+        normals = np.asarray(mesh.point_data['Normals'], dtype=np.float32)
+
+    return points, triangles, normals
+
+
+def get_quantization(points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Calculate offset and step for 16-bit vertex quantization
+    a vertex is restored by (quantized vertex * step + offset)
+    The step is the same for every axis: glTF viewers transform normals by the inverse transpose of the node
+    transform, so a non-uniform scale would bend the stored normals
+
+    Parameters
+    ----------
+    points : np.ndarray
+        vertex coordinates (shape = (the number of vertices, 3))
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        first element  : offset of each axis
+        second element : step of each axis (equal on every axis)
+    """
+    offset = points.min(axis=0).astype(np.float64)
+    extent = (points.max(axis=0).astype(np.float64) - offset).max()
+    if extent == 0:
+        extent = 1.
+    return offset, np.full(3, extent / 65535)
+
+
+def quantize_points(points: np.ndarray, offset: np.ndarray, step: np.ndarray) -> np.ndarray:
+    """Quantize vertex coordinates into 16-bit unsigned integers
+
+    Parameters
+    ----------
+    points : np.ndarray
+        vertex coordinates (shape = (the number of vertices, 3))
+    offset : np.ndarray
+        offset of each axis from get_quantization
+    step   : np.ndarray
+        step of each axis from get_quantization
+
+    Returns
+    -------
+    np.ndarray
+        quantized vertex coordinates
+    """
+    return np.clip(np.round((points - offset) / step), 0, 65535).astype(np.uint16)
+
+
+def encode_oct(normals: np.ndarray) -> np.ndarray:
+    """Encode unit normals into two 16-bit signed integers with octahedral mapping
+
+    Parameters
+    ----------
+    normals : np.ndarray
+        unit normals (shape = (the number of normals, 3))
+
+    Returns
+    -------
+    np.ndarray
+        encoded normals (shape = (the number of normals, 2)), decoded as snorm16
+    """
+    normals = normals.astype(np.float64)
+    norm = np.sum(np.abs(normals), axis=1, keepdims=True)
+    norm[norm == 0] = 1
+    normals = normals / norm
+
+    x = normals[:, 0].copy()
+    y = normals[:, 1].copy()
+
+    # the lower hemisphere is folded over the diagonals
+    lower = normals[:, 2] < 0
+    x[lower] = (1 - np.abs(normals[lower, 1])) * np.where(normals[lower, 0] >= 0, 1, -1)
+    y[lower] = (1 - np.abs(normals[lower, 0])) * np.where(normals[lower, 1] >= 0, 1, -1)
+
+    return np.round(np.clip(np.stack((x, y), axis=1), -1, 1) * 32767).astype(np.int16)
+
+
+def create_vertex_dtype(quantize: bool, normals: Union[np.ndarray, None], oct_normals: bool,
+                        pad=False) -> np.dtype:
+    """Create a record type for a vertex
+
+    Parameters
+    ----------
+    quantize    : bool
+        store coordinates as 16-bit unsigned integers
+    normals     : np.ndarray or None
+        vertex normals, no normal field if it is None
+    oct_normals : bool
+        store normals as two 16-bit signed integers
+    pad         : bool
+        align each attribute to 4 bytes (glTF vertex attributes)
+
+    Returns
+    -------
+    np.dtype
+        record type for a vertex
+    """
+    fields = [('xyz', '<u2' if quantize else '<f4', (3,))]
+    if quantize and pad:
+        fields.append(('xyz_pad', '<u2'))
+
+    if normals is not None:
+        if oct_normals:
+            fields.append(('normal', '<i2', (2,)))
+        else:
+            fields.append(('normal', '<f4', (3,)))
+
+    return np.dtype(fields)
+
+
+def fill_vertex_chunk(record: np.ndarray, points: np.ndarray, normals: Union[np.ndarray, None], quantization,
+                      oct_normals: bool) -> None:
+    """Fill records of a vertex chunk
+
+    Parameters
+    ----------
+    record       : np.ndarray
+        records to fill, created with create_vertex_dtype
+    points       : np.ndarray
+        vertex coordinates of the chunk
+    normals      : np.ndarray or None
+        vertex normals of the chunk
+    quantization : (np.ndarray, np.ndarray) or None
+        offset and step from get_quantization, coordinates are stored as they are if it is None
+    oct_normals  : bool
+        store normals with octahedral mapping
+    """
+    if quantization is None:
+        record['xyz'] = points
+    else:
+        record['xyz'] = quantize_points(points, *quantization)
+
+    if normals is not None:
+        record['normal'] = encode_oct(normals) if oct_normals else normals
+
+
+def save_ply_binary(mesh: pv.PolyData, output_path: str, chunk_size=CHUNK_SIZE) -> None:
+    """Save a mesh as binary little-endian PLY, written in chunks
+    Only standard PLY properties are written, so quantization and octahedral normals are not available
+
+    Parameters
+    ----------
+    mesh        : pyvista.PolyData
+        mesh object
+    output_path : str
+        output file including file path
+    chunk_size  : int
+        the number of vertices or triangles written at once
+    """
+    points, triangles, normals = get_mesh_arrays(mesh)
+    vertex_dtype = create_vertex_dtype(False, normals, False)
+
+    header = ['ply', 'format binary_little_endian 1.0', 'comment created by dcm-3d',
+              f'element vertex {points.shape[0]}']
+    header += [f'property float {axis}' for axis in ('x', 'y', 'z')]
+    if normals is not None:
+        header += ['property float nx', 'property float ny', 'property float nz']
+    header += [f'element face {triangles.shape[0]}', 'property list uchar uint vertex_indices', 'end_header']
+
+    face_dtype = np.dtype([('n', 'u1'), ('indices', '<u4', (3,))])
+
+    with open(output_path, 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode('ascii'))
+
+        for start in range(0, points.shape[0], chunk_size):
+            end = min(start + chunk_size, points.shape[0])
+            record = np.empty(end - start, dtype=vertex_dtype)
+            fill_vertex_chunk(record, points[start:end], None if normals is None else normals[start:end], None,
+                              False)
+            f.write(record.tobytes())
+
+        for start in range(0, triangles.shape[0], chunk_size):
+            end = min(start + chunk_size, triangles.shape[0])
+            record = np.empty(end - start, dtype=face_dtype)
+            record['n'] = 3
+            record['indices'] = triangles[start:end]
+            f.write(record.tobytes())
+
+
+def save_glb(mesh: pv.PolyData, output_path: str, quantize=False, oct_normals=False, chunk_size=CHUNK_SIZE) -> None:
+    """Save a mesh as binary glTF (.glb), written in chunks
+    Quantized coordinates use KHR_mesh_quantization with the restoring transform on the node.
+    Octahedral normals are stored in the application-specific attribute _NORMAL_OCT instead of NORMAL,
+    so a viewer has to decode them.
+
+    Parameters
+    ----------
+    mesh        : pyvista.PolyData
+        mesh object
+    output_path : str
+        output file including file path
+    quantize    : bool
+        store coordinates as 16-bit unsigned integers
+    oct_normals : bool
+        store normals as two 16-bit signed integers with octahedral mapping
+    chunk_size  : int
+        the number of vertices or triangles written at once
+    """
+    points, triangles, normals = get_mesh_arrays(mesh)
+    n_points = points.shape[0]
+    vertex_dtype = create_vertex_dtype(quantize, normals, oct_normals, pad=True)
+    quantization = get_quantization(points) if quantize else None
+
+    # smaller indices are enough for small meshes
+    index_dtype = np.dtype('<u2') if n_points <= 65535 else np.dtype('<u4')
+
+    vertex_length = n_points * vertex_dtype.itemsize
+    index_length = triangles.size * index_dtype.itemsize
+    index_offset = vertex_length
+    bin_length = index_offset + index_length + (-index_length % 4)
+
+    node = {'mesh': 0}
+    attributes = {'POSITION': 0}
+    if quantize:
+        offset, step = quantization
+        node['translation'] = offset.tolist()
+        node['scale'] = step.tolist()
+        pos_accessor = {'bufferView': 0, 'byteOffset': 0, 'componentType': GL_UNSIGNED_SHORT, 'count': n_points,
+                        'type': 'VEC3', 'min': [0, 0, 0],
+                        'max': quantize_points(points.max(axis=0), offset, step).tolist()}
+    else:
+        pos_accessor = {'bufferView': 0, 'byteOffset': 0, 'componentType': GL_FLOAT, 'count': n_points,
+                        'type': 'VEC3', 'min': points.min(axis=0).tolist(), 'max': points.max(axis=0).tolist()}
+    accessors = [pos_accessor]
+
+    if normals is not None:
+        normal_offset = vertex_dtype.fields['normal'][1]
+        if oct_normals:
+            attributes['_NORMAL_OCT'] = len(accessors)
+            accessors.append({'bufferView': 0, 'byteOffset': normal_offset, 'componentType': GL_SHORT,
+                              'normalized': True, 'count': n_points, 'type': 'VEC2'})
+        else:
+            attributes['NORMAL'] = len(accessors)
+            accessors.append({'bufferView': 0, 'byteOffset': normal_offset, 'componentType': GL_FLOAT,
+                              'count': n_points, 'type': 'VEC3'})
+
+    indices = len(accessors)
+    accessors.append({'bufferView': 1, 'byteOffset': 0,
+                      'componentType': GL_UNSIGNED_SHORT if index_dtype.itemsize == 2 else GL_UNSIGNED_INT,
+                      'count': int(triangles.size), 'type': 'SCALAR'})
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'dcm-3d'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [node],
+        'meshes': [{'primitives': [{'attributes': attributes, 'indices': indices, 'mode': 4}]}],
+        'buffers': [{'byteLength': bin_length}],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0, 'byteLength': vertex_length, 'byteStride': vertex_dtype.itemsize,
+             'target': GL_ARRAY_BUFFER},
+            {'buffer': 0, 'byteOffset': index_offset, 'byteLength': index_length, 'target': GL_ELEMENT_ARRAY_BUFFER}
+        ],
+        'accessors': accessors
+    }
+    if quantize:
+        gltf['extensionsUsed'] = ['KHR_mesh_quantization']
+        gltf['extensionsRequired'] = ['KHR_mesh_quantization']
+
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    total_length = 12 + 8 + len(json_chunk) + 8 + bin_length
+
+    with open(output_path, 'wb') as f:
+        f.write(struct.pack('<III', GLB_MAGIC, 2, total_length))
+        f.write(struct.pack('<II', len(json_chunk), GLB_JSON))
+        f.write(json_chunk)
+        f.write(struct.pack('<II', bin_length, GLB_BIN))
+
+        for start in range(0, n_points, chunk_size):
+            end = min(start + chunk_size, n_points)
+            record = np.zeros(end - start, dtype=vertex_dtype)
+            fill_vertex_chunk(record, points[start:end], None if normals is None else normals[start:end],
+                              quantization, oct_normals)
+            f.write(record.tobytes())
+
+        for start in range(0, triangles.shape[0], chunk_size):
+            end = min(start + chunk_size, triangles.shape[0])
+            f.write(triangles[start:end].astype(index_dtype).tobytes())
+        f.write(b'\x00' * (-index_length % 4))
+
+
+def export_mesh(mesh: pv.PolyData, output_path: str, quantize=False, oct_normals=False,
+                compare_legacy=False) -> dict:
+    """Save a mesh as binary glTF (.glb) or binary PLY (.ply) and measure the size and time
+
+    Parameters
+    ----------
+    mesh           : pyvista.PolyData
+        mesh object
+    output_path    : str
+        output file including file path, the extension has to be either .glb or .ply
+    quantize       : bool
+        store coordinates as 16-bit unsigned integers (.glb only)
+    oct_normals    : bool
+        store normals as two 16-bit signed integers with octahedral mapping (.glb only)
+    compare_legacy : bool
+        also save the mesh as legacy .vtk in a temporary file to measure the size and time saved
+
+    Returns
+    -------
+    dict
+        size (bytes) and time (seconds) of the output, and of legacy .vtk if compare_legacy is True
+    """
+    _, ext = path.splitext(output_path)
+    if ext not in ('.glb', '.ply'):
+        raise ValueError(f'{output_path} is not valid extension, it has to be either .glb or .ply')
+
+    # PLY readers know nothing about the decoding, so they would load quantized coordinates as they are
+    if ext == '.ply' and (quantize or oct_normals):
+        raise ValueError('quantized coordinates and octahedral normals are only available for .glb output')
+
+    start = time.perf_counter()
+    if ext == '.glb':
+        save_glb(mesh, output_path, quantize=quantize, oct_normals=oct_normals)
+    else:
+        save_ply_binary(mesh, output_path)
+    report = {'bytes': os.path.getsize(output_path), 'seconds': time.perf_counter() - start}
+
+    if compare_legacy:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            legacy_path = path.join(tmp_dir, 'legacy.vtk')
+            start = time.perf_counter()
+            mesh.save(legacy_path)
+            report['legacy_seconds'] = time.perf_counter() - start
+            report['legacy_bytes'] = os.path.getsize(legacy_path)
+
+    return report
@@ -1,19 +1,31 @@
 import vtk
 import pyvista as pv
+from graphic_handler.parallel_util import configure_filter, prefer_smp
+from job_handler.job import update_filter
 
 
 def convert_pcd2mesh(point_cloud: pv.PolyData, alpha=0.) -> pv.PolyData:
-    mesh = point_cloud.delaunay_3d(alpha=alpha, progress_bar=True)
+    # vtkDelaunay3D with the settings of pyvista's delaunay_3d, so that its progress can be reported
+    delaunay = vtk.vtkDelaunay3D()
+    delaunay.SetInputData(point_cloud)
+    delaunay.SetAlpha(alpha)
+    delaunay.SetTolerance(0.001)
+    delaunay.SetOffset(2.5)
+    update_filter(delaunay, 'delaunay 3D')
+
+    mesh = pv.wrap(delaunay.GetOutput())
     mesh = mesh.extract_geometry().triangulate()
     return mesh
 
 
 def marchingCubes(volume) -> pv.PolyData:
     # use marching cube algorithm
-    cf = vtk.vtkMarchingCubes()
+    # flying edges is the multithreaded equivalent of marching cubes (same triangles and normals)
+    cf = vtk.vtkFlyingEdges3D() if prefer_smp() else vtk.vtkMarchingCubes()
+    configure_filter(cf)
     cf.SetInputData(volume)
     cf.SetValue(0, 1)
-    cf.Update()
+    update_filter(cf, 'marching cubes')
 
     # reverse the normal
     reverse = vtk.vtkReverseSense()
@@ -21,7 +33,7 @@ def marchingCubes(volume) -> pv.PolyData:
     reverse.ReverseCellsOn()
     reverse.ReverseNormalsOn()
 
-    reverse.Update()
+    update_filter(reverse, 'reversing normals')
 
     mesh = reverse.GetOutput()
     mesh = pv.wrap(mesh)
@@ -31,10 +43,11 @@ def marchingCubes(volume) -> pv.PolyData:
 def flyingEdges(volume) -> pv.PolyData:
     # use flying edges algorithm
     fe = vtk.vtkFlyingEdges3D()
+    configure_filter(fe)
     fe.SetInputData(volume)
     fe.SetValue(0, 1)
     fe.ComputeNormalsOn()
-    fe.Update()
+    update_filter(fe, 'flying edges')
 
     mesh = fe.GetOutput()
     mesh = pv.wrap(mesh)
@@ -43,11 +56,13 @@ def flyingEdges(volume) -> pv.PolyData:
 
 def discreteMarchingCubes(volume) -> pv.PolyData:
     # use discrete marching cube algorithm
-    dm = vtk.vtkDiscreteMarchingCubes()
+    # discrete flying edges is the multithreaded equivalent of discrete marching cubes
+    dm = vtk.vtkDiscreteFlyingEdges3D() if prefer_smp() else vtk.vtkDiscreteMarchingCubes()
+    configure_filter(dm)
     dm.SetInputData(volume)
     dm.ComputeNormalsOn()
     dm.GenerateValues(1, 0, 255)
-    dm.Update()
+    update_filter(dm, 'discrete marching cubes')
 
     mesh = dm.GetOutput()
     mesh = pv.wrap(mesh)
@@ -57,10 +72,11 @@ def discreteMarchingCubes(volume) -> pv.PolyData:
 def synchronizedTemplates3D(volume) -> pv.PolyData:
     # use SynchronizedTemplates3D algorithm
     st = vtk.vtkSynchronizedTemplates3D()
+    configure_filter(st)
     st.SetInputData(volume)
     st.SetValue(0, 1)
     st.ComputeNormalsOn()
-    st.Update()
+    update_filter(st, 'synchronized templates 3D')
 
     mesh = st.GetOutput()
     mesh = pv.wrap(mesh)
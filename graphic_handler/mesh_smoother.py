@@ -0,0 +1,171 @@
+import numpy as np
+import pyvista as pv
+import scipy.sparse as sp
+from typing import Union
+
+from job_handler.job import track
+
+
+def get_triangles(mesh: pv.PolyData) -> np.ndarray:
+    """Return the triangles of a mesh as vertex indices
+
+    Parameters
+    ----------
+    mesh : pyvista.PolyData
+        mesh object
+
+    Returns
+    -------
+    np.ndarray
+        vertex indices of each triangle (shape = (the number of triangles, 3))
+    """
+    if not mesh.is_all_triangles:
+        mesh = mesh.triangulate()
+
+    return mesh.faces.reshape(-1, 4)[:, 1:]
+
+
+def build_adjacency(points: np.ndarray, triangles: np.ndarray, weight='uniform') -> sp.csr_matrix:
+    """Build a row-normalized vertex adjacency matrix
+    Multiplying the matrix with the vertex coordinates gives the weighted average of the neighbours of each vertex
+
+    Parameters
+    ----------
+    points    : np.ndarray
+        vertex coordinates (shape = (the number of vertices, 3))
+    triangles : np.ndarray
+        vertex indices of each triangle (shape = (the number of triangles, 3))
+    weight    : str
+        'uniform'   : every neighbour has the same weight
+        'cotangent' : a neighbour is weighted by the cotangents of the angles opposite to the shared edge
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        row-normalized adjacency matrix (shape = (the number of vertices, the number of vertices))
+    """
+    n_points = points.shape[0]
+
+    # each triangle (a, b, c) has edges (a, b), (b, c), (c, a)
+    # and the vertex opposite to each of them is c, a, b
+    start = triangles.ravel()
+    end = np.roll(triangles, -1, axis=1).ravel()
+
+    if weight == 'uniform':
+        values = np.ones(start.shape[0], dtype=np.float64)
+    elif weight == 'cotangent':
+        opposite = np.roll(triangles, 1, axis=1).ravel()
+        u = points[start] - points[opposite]
+        v = points[end] - points[opposite]
+        cross = np.linalg.norm(np.cross(u, v), axis=1)
+        dot = np.einsum('ij,ij->i', u, v)
+        # degenerate triangles and obtuse angles would give infinite or negative weights
+        values = np.maximum(0.5 * dot / np.maximum(cross, np.finfo(np.float64).eps), 0)
+    else:
+        raise ValueError(f'{weight} has to be either uniform or cotangent')
+
+    # symmetric matrix, duplicated edges are summed while converting into csr format
+    adjacency = sp.coo_matrix((np.concatenate((values, values)), (np.concatenate((start, end)),
+                                                                  np.concatenate((end, start)))),
+                              shape=(n_points, n_points)).tocsr()
+
+    if weight == 'uniform':
+        adjacency.data[:] = 1
+
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    # isolated vertices keep their position
+    isolated = degree == 0
+    degree[isolated] = 1
+    adjacency = sp.diags(1 / degree) @ adjacency
+    adjacency = adjacency + sp.diags(isolated.astype(np.float64))
+
+    return adjacency.tocsr()
+
+
+def find_boundary_vertex(triangles: np.ndarray, n_points: int) -> np.ndarray:
+    """Find vertices on the boundary of a mesh
+    A boundary edge is used by only one triangle
+
+    Parameters
+    ----------
+    triangles : np.ndarray
+        vertex indices of each triangle (shape = (the number of triangles, 3))
+    n_points  : int
+        the number of vertices
+
+    Returns
+    -------
+    np.ndarray
+        boolean mask of boundary vertices (shape = (the number of vertices,))
+    """
+    start = triangles.ravel().astype(np.int64)
+    end = np.roll(triangles, -1, axis=1).ravel().astype(np.int64)
+
+    # encode an undirected edge into one integer to count edges with a 1D sort
+    keys = np.minimum(start, end) * n_points + np.maximum(start, end)
+    keys, counts = np.unique(keys, return_counts=True)
+    keys = keys[counts == 1]
+
+    is_boundary = np.zeros(n_points, dtype=bool)
+    is_boundary[keys // n_points] = True
+    is_boundary[keys % n_points] = True
+    return is_boundary
+
+
+def smooth_mesh_sparse(mesh: pv.PolyData, n_iter=20, lamb=0.5, mu: Union[float, None] = -0.53, weight='uniform',
+                       pin_boundary=True) -> pv.PolyData:
+    """Smooth a mesh with Laplacian or Taubin (lambda / mu) iterations
+    The adjacency matrix is built once, every iteration is a sparse matrix-dense matrix product
+
+    Parameters
+    ----------
+    mesh         : pyvista.PolyData
+        mesh object
+    n_iter       : int
+        the number of iterations, a Taubin iteration has a lambda step and a mu step
+    lamb         : float
+        scale factor for shrinking step
+    mu           : float or None
+        scale factor for inflating step (negative, |mu| > lamb)
+        if it is None, Laplacian smoothing is applied
+    weight       : str
+        weight of neighbours, either 'uniform' or 'cotangent'
+    pin_boundary : bool
+        keep the boundary vertices on their position
+
+    Returns
+    -------
+    pyvista.PolyData
+        smoothed mesh
+    """
+    if not isinstance(mesh, pv.PolyData):
+        mesh = pv.wrap(mesh)
+
+    triangles = get_triangles(mesh)
+    points = np.asarray(mesh.points, dtype=np.float64)
+
+    adjacency = build_adjacency(points, triangles, weight)
+
+    # a pinned vertex moves by zero in every step
+    movable = np.ones((points.shape[0], 1), dtype=np.float64)
+    if pin_boundary:
+        movable[find_boundary_vertex(triangles, points.shape[0])] = 0
+
+    factors = [lamb] if mu is None else [lamb, mu]
+    for _ in track(range(n_iter), 'sparse smoothing'):
+        for factor in factors:
+            points += (factor * movable) * (adjacency @ points - points)
+
+    mesh = mesh.copy()
+    mesh.points = points.astype(mesh.points.dtype)
+    return mesh
+
+
+def smooth_mesh_taubin(mesh: pv.PolyData, n_iter=20, lamb=0.5, mu=-0.53, weight='uniform',
+                       pin_boundary=True) -> pv.PolyData:
+    return smooth_mesh_sparse(mesh, n_iter, lamb, mu, weight, pin_boundary)
+
+
+def smooth_mesh_laplacian_sparse(mesh: pv.PolyData, n_iter=20, lamb=0.1, weight='uniform',
+                                 pin_boundary=True) -> pv.PolyData:
+    return smooth_mesh_sparse(mesh, n_iter, lamb, None, weight, pin_boundary)
@@ -0,0 +1,240 @@
+import multiprocessing as mp
+import os
+import os.path as path
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Tuple
+
+import imageio
+import numpy as np
+import pyvista as pv
+import vtk
+
+# direction of the up side of the camera while orbiting (pyvista's default)
+VIEWUP = (0., 0., 1.)
+
+
+def create_preview(mesh: pv.DataSet, max_cells=200000) -> pv.PolyData:
+    """Decimate a mesh to the level of detail for preview
+
+    Parameters
+    ----------
+    mesh      : pyvista.DataSet
+        mesh object
+    max_cells : int
+        the maximum number of triangles in the preview
+
+    Returns
+    -------
+    pyvista.PolyData
+        preview mesh
+    """
+    if not isinstance(mesh, pv.PolyData):
+        mesh = mesh.extract_surface()
+
+    if mesh.n_cells > max_cells:
+        if not mesh.is_all_triangles:
+            mesh = mesh.triangulate()
+        mesh = mesh.decimate(1 - max_cells / mesh.n_cells)
+
+    return mesh
+
+
+def check_offscreen_support() -> None:
+    """Raise RuntimeError if vtk can't render without a display
+    vtk built with EGL or OSMesa (and the wheels of vtk 9.4 or later, which fall back to them) renders anywhere,
+    but a vtk that renders through X11 aborts the process without an X server, even off screen
+    """
+    window = vtk.vtkRenderWindow()
+    if window.GetClassName() == 'vtkXOpenGLRenderWindow' and not os.environ.get('DISPLAY'):
+        raise RuntimeError(f'vtk {vtk.vtkVersion.GetVTKVersion()} renders through X11 and DISPLAY is not set, '
+                           f'run it under xvfb-run or install vtk built with EGL or OSMesa to render without a display')
+
+
+def setup_plotter(mesh: pv.PolyData, window_size: Tuple[int, int]) -> pv.Plotter:
+    plotter = pv.Plotter(off_screen=True, window_size=list(window_size))
+    plotter.add_mesh(mesh)
+    return plotter
+
+
+def render_frames(mesh_path: str, indices: List[int], n_frames: int,
+                  window_size: Tuple[int, int]) -> List[Tuple[int, np.ndarray]]:
+    """Render frames of the orbit around a mesh without a display
+    Every worker builds the same orbit, so that frames rendered by different workers line up
+
+    Parameters
+    ----------
+    mesh_path   : str
+        preview mesh file
+    indices     : List[int]
+        indices of the frames to render
+    n_frames    : int
+        the number of frames in the whole orbit
+    window_size : (int, int)
+        width and height of a frame
+
+    Returns
+    -------
+    List[(int, np.ndarray)]
+        index and image of each rendered frame
+    """
+    mesh = pv.read(mesh_path)
+    plotter = setup_plotter(mesh, window_size)
+
+    orbit_path = plotter.generate_orbital_path(n_points=n_frames, shift=mesh.length, viewup=VIEWUP)
+    focus = plotter.center
+    plotter.camera.thickness = orbit_path.length
+
+    frames = []
+    for index in indices:
+        plotter.set_position(orbit_path.points[index])
+        plotter.set_focus(focus)
+        plotter.set_viewup(VIEWUP)
+        plotter.renderer.ResetCameraClippingRange()
+        frames.append((index, plotter.screenshot(return_img=True)))
+
+    plotter.close()
+    return frames
+
+
+def render_thumbnail(mesh_path: str, output_path: str, window_size: Tuple[int, int]) -> None:
+    """Render an isometric view of a mesh without a display and save it as an image
+
+    Parameters
+    ----------
+    mesh_path   : str
+        preview mesh file
+    output_path : str
+        output image file including file path
+    window_size : (int, int)
+        width and height of the thumbnail
+    """
+    mesh = pv.read(mesh_path)
+    plotter = setup_plotter(mesh, window_size)
+    plotter.view_isometric()
+    imageio.imwrite(output_path, plotter.screenshot(return_img=True))
+    plotter.close()
+
+
+def write_animation(frames: List[np.ndarray], output_path: str, fps=10) -> None:
+    """Encode frames into a gif or mp4 file at once
+
+    Parameters
+    ----------
+    frames      : List[np.ndarray]
+        images in order
+    output_path : str
+        output file including file path, the extension has to be either .gif or .mp4
+    fps         : int
+        frames per second
+    """
+    _, ext = path.splitext(output_path)
+    if ext == '.gif':
+        # same setting as pyvista.Plotter.open_gif
+        writer = imageio.get_writer(output_path, mode='I', loop=0, duration=1000 / fps)
+    elif ext == '.mp4':
+        writer = imageio.get_writer(output_path, fps=fps)
+    else:
+        raise ValueError(f'{output_path} is not valid extension for animation')
+
+    for frame in frames:
+        writer.append_data(frame)
+    writer.close()
+
+
+def render_orbit(file_path: str, output_path: str, thumbnail_path: str = None, n_frames=36, max_cells=200000,
+                 window_size=(800, 600), thumbnail_size=(256, 256), fps=10, executor: Executor = None,
+                 n_workers: int = None) -> None:
+    """Render the orbit around a mesh without a display
+    The mesh is decimated to a preview once, the frames are split across worker processes
+    and encoded at the end
+
+    Parameters
+    ----------
+    file_path      : str
+        input 3D object file
+    output_path    : str
+        output animation including file path (.gif or .mp4)
+    thumbnail_path : str
+        output thumbnail image including file path, no thumbnail if it is None
+    n_frames       : int
+        the number of frames in the orbit
+    max_cells      : int
+        the maximum number of triangles in the preview
+    window_size    : (int, int)
+        width and height of a frame
+    thumbnail_size : (int, int)
+        width and height of the thumbnail
+    fps            : int
+        frames per second
+    executor       : concurrent.futures.Executor
+        executor to run the workers, a process pool is created if it is not given
+    n_workers      : int
+        the number of workers (the frames are split into this many tasks), all cores are used if it is not given
+    """
+    _, ext = path.splitext(output_path)
+    if ext not in ('.gif', '.mp4'):
+        raise ValueError(f'{output_path} is not valid extension for animation')
+
+    n_workers = min(n_workers or os.cpu_count() or 1, n_frames)
+
+    if executor is None:
+        # a worker that can't render dies without a message, so the support is checked before starting them
+        check_offscreen_support()
+        # vtk doesn't survive fork safely, so the workers are spawned
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn')) as executor:
+            render_orbit(file_path, output_path, thumbnail_path, n_frames, max_cells, window_size, thumbnail_size,
+                         fps, executor, n_workers)
+        return
+
+    mesh = create_preview(pv.read(file_path), max_cells)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # workers read the small preview instead of the full-resolution mesh
+        preview_path = path.join(tmp_dir, 'preview.vtk')
+        mesh.save(preview_path)
+
+        futures = [executor.submit(render_frames, preview_path, list(range(i, n_frames, n_workers)), n_frames,
+                                   window_size) for i in range(n_workers)]
+        if thumbnail_path is not None:
+            futures.append(executor.submit(render_thumbnail, preview_path, thumbnail_path, thumbnail_size))
+
+        frames = [None] * n_frames
+        for future in futures[:n_workers]:
+            for index, frame in future.result():
+                frames[index] = frame
+        for future in futures[n_workers:]:
+            future.result()
+
+    write_animation(frames, output_path, fps)
+
+
+def render_batch(file_paths: List[str], output_dir: str, ext='.gif', n_workers: int = None, **kwargs) -> None:
+    """Render the orbit and the thumbnail of every mesh without a display
+    <output_dir>/<file name>.gif (or .mp4) and <output_dir>/<file name>.png are created for each mesh
+
+    Parameters
+    ----------
+    file_paths : List[str]
+        input 3D object files
+    output_dir : str
+        directory path for the outputs
+    ext        : str
+        extension of the animation, either .gif or .mp4
+    n_workers  : int
+        the number of worker processes, all cores are used if it is not given
+    kwargs     : dict
+        settings of render_orbit (ex. n_frames, max_cells, window_size)
+    """
+    check_offscreen_support()
+    os.makedirs(output_dir, exist_ok=True)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    # one pool is shared by every mesh, so the workers are spawned only once
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn')) as executor:
+        for file_path in file_paths:
+            name, _ = path.splitext(path.basename(file_path))
+            print(f'Rendering {file_path}...', end=' ', flush=True)
+            render_orbit(file_path, path.join(output_dir, name + ext), path.join(output_dir, name + '.png'),
+                         executor=executor, n_workers=n_workers, **kwargs)
+            print('Done')
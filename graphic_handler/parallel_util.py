@@ -0,0 +1,138 @@
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+import vtk
+
+# the number of threads given by set_num_threads
+# None means that vtk runs with its own default setting
+_num_threads = None
+# vtkSMPTools backend that vtk starts with, see reset_num_threads
+_default_backend = vtk.vtkSMPTools.GetBackend()
+
+
+def set_num_threads(n_threads: int = None, backend: str = None) -> int:
+    """Configure the number of threads used by vtk filters
+    vtkSMPTools (flying edges, windowed sinc, ...) and vtkMultiThreader (threaded image filters)
+    are set to the same number of threads
+
+    Parameters
+    ----------
+    n_threads : int
+        the number of threads, all cores are used if it is not given
+    backend : str
+        vtkSMPTools backend ('Sequential', 'STDThread', 'TBB', 'OpenMP')
+        if it is not given, VTK_SMP_BACKEND_IN_USE environment variable or 'STDThread' is used
+
+    Returns
+    -------
+    int
+        the number of threads in use
+    """
+    global _num_threads
+
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+
+    if n_threads < 1:
+        raise ValueError(f'the number of threads has to be positive, but {n_threads} is given')
+
+    if n_threads == 1:
+        backend = 'Sequential'
+    elif backend is None:
+        backend = os.environ.get('VTK_SMP_BACKEND_IN_USE', 'STDThread')
+
+    vtk.vtkSMPTools.SetBackend(backend)
+    vtk.vtkSMPTools.Initialize(n_threads)
+    vtk.vtkMultiThreader.SetGlobalDefaultNumberOfThreads(n_threads)
+
+    _num_threads = n_threads
+    return n_threads
+
+
+def reset_num_threads() -> None:
+    """Undo set_num_threads, so that vtk runs with its own default setting again
+    """
+    global _num_threads
+
+    vtk.vtkSMPTools.SetBackend(_default_backend)
+    vtk.vtkSMPTools.Initialize(0)
+    vtk.vtkMultiThreader.SetGlobalDefaultNumberOfThreads(0)
+
+    _num_threads = None
+
+
+@contextmanager
+def use_num_threads(n_threads: int = None) -> Iterator[int]:
+    """Configure the number of threads used by vtk filters while running a block
+    The setting before the block is restored afterwards, even if the block fails
+
+    Parameters
+    ----------
+    n_threads : int
+        the number of threads, the setting is left as it is if it is None
+
+    Returns
+    -------
+    Iterator[int]
+        the number of threads in use, None if it is not configured
+    """
+    if n_threads is None:
+        yield _num_threads
+        return
+
+    previous_threads = _num_threads
+    try:
+        yield set_num_threads(n_threads)
+    finally:
+        if previous_threads is None:
+            reset_num_threads()
+        else:
+            set_num_threads(previous_threads)
+
+
+def get_num_threads() -> int:
+    """Return the number of threads given by set_num_threads
+
+    Returns
+    -------
+    int
+        the number of threads, None if it is not configured
+    """
+    return _num_threads
+
+
+def prefer_smp() -> bool:
+    """Check whether multithreaded filters are preferred over single-threaded ones
+    Only an explicit single thread keeps the single-threaded filters
+
+    Returns
+    -------
+    bool
+        True, if multithreaded filters should be used
+    """
+    return _num_threads != 1
+
+
+def configure_filter(vtk_filter):
+    """Apply the configured number of threads to a vtk filter
+    filters based on vtkSMPTools follow the global setting, so only threaded image filters are changed here
+
+    Parameters
+    ----------
+    vtk_filter
+        vtk filter to configure
+
+    Returns
+    -------
+        the same vtk filter
+    """
+    if _num_threads is None:
+        return vtk_filter
+
+    if hasattr(vtk_filter, 'SetEnableSMP'):
+        vtk_filter.SetEnableSMP(_num_threads > 1)
+    if hasattr(vtk_filter, 'SetNumberOfThreads'):
+        vtk_filter.SetNumberOfThreads(_num_threads)
+
+    return vtk_filter
@@ -0,0 +1,144 @@
+import json
+import os
+import struct
+
+import numpy as np
+import pytest
+import pyvista as pv
+
+from graphic_handler.mesh_exporter import (GL_FLOAT, GL_SHORT, GL_UNSIGNED_INT, GL_UNSIGNED_SHORT, GLB_BIN,
+                                           GLB_JSON, GLB_MAGIC, export_mesh, get_mesh_arrays, save_glb)
+
+# numpy type of each glTF component type
+COMPONENT_DTYPES = {GL_SHORT: '<i2', GL_UNSIGNED_SHORT: '<u2', GL_UNSIGNED_INT: '<u4', GL_FLOAT: '<f4'}
+N_COMPONENTS = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3}
+
+
+def create_mesh(resolution=30) -> pv.PolyData:
+    return pv.Sphere(radius=30., center=(10., -20., 5.), theta_resolution=resolution,
+                     phi_resolution=resolution).compute_normals()
+
+
+def read_glb(file_path: str) -> (dict, bytes):
+    """Read the header and the chunks of a binary glTF file, checking the layout on the way
+
+    Parameters
+    ----------
+    file_path : str
+        .glb file
+
+    Returns
+    -------
+    (dict, bytes)
+        first element  : glTF json
+        second element : binary chunk
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    magic, version, total_length = struct.unpack_from('<III', data, 0)
+    assert (magic, version, total_length) == (GLB_MAGIC, 2, len(data))
+
+    json_length, json_type = struct.unpack_from('<II', data, 12)
+    assert json_type == GLB_JSON and json_length % 4 == 0
+    gltf = json.loads(data[20:20 + json_length])
+
+    bin_start = 20 + json_length
+    bin_length, bin_type = struct.unpack_from('<II', data, bin_start)
+    assert bin_type == GLB_BIN and bin_length % 4 == 0
+    assert bin_start + 8 + bin_length == len(data)
+    assert gltf['buffers'] == [{'byteLength': bin_length}]
+
+    return gltf, data[bin_start + 8:]
+
+
+def read_accessor(gltf: dict, binary: bytes, index: int) -> np.ndarray:
+    accessor = gltf['accessors'][index]
+    view = gltf['bufferViews'][accessor['bufferView']]
+    dtype = np.dtype(COMPONENT_DTYPES[accessor['componentType']])
+    n_components = N_COMPONENTS[accessor['type']]
+    stride = view.get('byteStride', dtype.itemsize * n_components)
+
+    # vertex attributes are 4-byte aligned and every element lies inside its buffer view
+    offset = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    assert offset % dtype.itemsize == 0
+    if 'byteStride' in view:
+        assert stride % 4 == 0 and offset % 4 == 0
+    n_bytes = (accessor['count'] - 1) * stride + dtype.itemsize * n_components
+    assert accessor.get('byteOffset', 0) + n_bytes <= view['byteLength']
+
+    values = np.frombuffer(binary, dtype=dtype, offset=offset, count=n_bytes // dtype.itemsize)
+    return np.lib.stride_tricks.as_strided(values, shape=(accessor['count'], n_components),
+                                           strides=(stride, dtype.itemsize)).copy()
+
+
+def decode_oct(encoded: np.ndarray) -> np.ndarray:
+    xy = np.maximum(encoded / 32767., -1.)
+    z = 1 - np.abs(xy).sum(axis=1)
+    lower = z < 0
+    folded = (1 - np.abs(xy[lower][:, ::-1])) * np.where(xy[lower] >= 0, 1, -1)
+    xy[lower] = folded
+    normals = np.column_stack((xy, z))
+    return normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('quantize', [False, True])
+@pytest.mark.parametrize('oct_normals', [False, True])
+@pytest.mark.parametrize('resolution, chunk_size', [(30, 100), (300, 1 << 20)])
+def test_glb_round_trip(tmp_path, quantize, oct_normals, resolution, chunk_size):
+    mesh = create_mesh(resolution)
+    points, triangles, normals = get_mesh_arrays(mesh)
+    file_path = os.path.join(str(tmp_path), 'mesh.glb')
+    save_glb(mesh, file_path, quantize=quantize, oct_normals=oct_normals, chunk_size=chunk_size)
+
+    gltf, binary = read_glb(file_path)
+    primitive = gltf['meshes'][0]['primitives'][0]
+    node = gltf['nodes'][0]
+
+    # vertices, restored by the node transform if they are quantized
+    position_accessor = gltf['accessors'][primitive['attributes']['POSITION']]
+    position = read_accessor(gltf, binary, primitive['attributes']['POSITION']).astype(np.float64)
+    assert position.min(axis=0).tolist() == position_accessor['min']
+    assert position.max(axis=0).tolist() == position_accessor['max']
+    if quantize:
+        assert 'KHR_mesh_quantization' in gltf['extensionsRequired']
+        assert position_accessor['componentType'] == GL_UNSIGNED_SHORT
+        # one step for every axis, so that normals aren't bent by the node transform
+        assert len(set(node['scale'])) == 1
+        position = position * node['scale'] + node['translation']
+        np.testing.assert_allclose(position, points, atol=node['scale'][0] / 2 + 1e-4)
+    else:
+        assert 'translation' not in node and 'scale' not in node
+        np.testing.assert_array_equal(position, points)
+
+    if oct_normals:
+        assert 'NORMAL' not in primitive['attributes']
+        decoded = decode_oct(read_accessor(gltf, binary, primitive['attributes']['_NORMAL_OCT']).astype(np.float64))
+        unit = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+        assert np.degrees(np.arccos(np.clip((decoded * unit).sum(axis=1), -1, 1))).max() < 0.05
+    else:
+        np.testing.assert_array_equal(read_accessor(gltf, binary, primitive['attributes']['NORMAL']), normals)
+
+    # 16-bit indices are enough for up to 65535 vertices
+    index_accessor = gltf['accessors'][primitive['indices']]
+    expected_type = GL_UNSIGNED_SHORT if points.shape[0] <= 65535 else GL_UNSIGNED_INT
+    assert index_accessor['componentType'] == expected_type
+    np.testing.assert_array_equal(read_accessor(gltf, binary, primitive['indices']).reshape(-1, 3), triangles)
+
+
+def test_ply_round_trip(tmp_path):
+    mesh = create_mesh()
+    file_path = os.path.join(str(tmp_path), 'mesh.ply')
+    export_mesh(mesh, file_path)
+
+    loaded = pv.read(file_path)
+    points, triangles, normals = get_mesh_arrays(mesh)
+    np.testing.assert_array_equal(loaded.points, points)
+    np.testing.assert_array_equal(loaded.faces.reshape(-1, 4)[:, 1:], triangles)
+    np.testing.assert_array_equal(loaded.point_data['Normals'], normals)
+
+
+@pytest.mark.parametrize('option', ['quantize', 'oct_normals'])
+def test_ply_refuses_glb_encodings(tmp_path, option):
+    with pytest.raises(ValueError):
+        export_mesh(create_mesh(), os.path.join(str(tmp_path), 'mesh.ply'), **{option: True})
@@ -0,0 +1,243 @@
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+# the job that the running code reports to, see run_job
+_job = None
+
+
+class JobCancelled(Exception):
+    """Raised when a job is cancelled or runs out of its time budget
+    """
+
+
+class Job:
+    """Progress, cancellation and time budget of a long-running job
+    Python loops report through track and vtk filters through update_filter,
+    both stop the job at the next report once it is cancelled or its budget is spent.
+    """
+
+    def __init__(self, budget: float = None, callback: Callable[[str, float, float], None] = None) -> None:
+        """Initialize the class
+
+        Parameters
+        ----------
+        budget   : float
+            wall-clock time budget (seconds), no limit if it is None
+        callback : Callable[[str, float, float], None]
+            function that receives the name of the running step, its progress (0 to 1) and the elapsed time (seconds)
+        """
+        if budget is not None and budget <= 0:
+            raise ValueError(f'the time budget has to be positive, but {budget} is given')
+
+        self.budget = budget
+        self.callback = callback
+        self.start_time = time.monotonic()
+        self.reason = None
+        # cancel can be called from another thread or a signal handler
+        self.cancel_event = threading.Event()
+
+    def cancel(self, reason='cancelled') -> None:
+        """Request the job to stop at the next report
+
+        Parameters
+        ----------
+        reason : str
+            message of the JobCancelled exception
+        """
+        if self.reason is None:
+            self.reason = reason
+        self.cancel_event.set()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def remaining(self) -> float:
+        """Return the remaining time budget
+
+        Returns
+        -------
+        float
+            remaining time (seconds), None if there is no time budget
+        """
+        if self.budget is None:
+            return None
+
+        return max(self.budget - self.elapsed(), 0.)
+
+    def should_stop(self) -> bool:
+        if self.budget is not None and not self.cancel_event.is_set() and self.elapsed() > self.budget:
+            self.cancel(f'time budget of {self.budget:g} s is exceeded')
+
+        return self.cancel_event.is_set()
+
+    def check(self) -> None:
+        """Raise JobCancelled if the job is cancelled or its time budget is spent
+        """
+        if self.should_stop():
+            raise JobCancelled(self.reason)
+
+    def report(self, step: str, fraction: float) -> None:
+        """Pass the progress to the callback and stop the job if it is cancelled
+
+        Parameters
+        ----------
+        step     : str
+            name of the running step
+        fraction : float
+            progress of the step (0 to 1)
+        """
+        if self.callback is not None:
+            self.callback(step, fraction, self.elapsed())
+        self.check()
+
+
+def get_job() -> Job:
+    """Return the job given by run_job
+
+    Returns
+    -------
+    Job
+        running job, None if there is no job
+    """
+    return _job
+
+
+@contextmanager
+def run_job(job: Job, handle_interrupt=True) -> Iterator[Job]:
+    """Make a job the one that the running code reports to
+
+    Parameters
+    ----------
+    job              : Job
+        job to run
+    handle_interrupt : bool
+        cancel the job on Ctrl+C, so that a running vtk filter is aborted
+        and the job stops at a clean point instead of in the middle of writing a file
+        (only available in the main thread)
+
+    Returns
+    -------
+    Iterator[Job]
+        the given job
+    """
+    global _job
+
+    previous_job = _job
+    previous_handler = None
+    if handle_interrupt and threading.current_thread() is threading.main_thread():
+        previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: job.cancel('interrupted'))
+
+    _job = job
+    try:
+        yield job
+    finally:
+        _job = previous_job
+        if previous_handler is not None:
+            signal.signal(signal.SIGINT, previous_handler)
+
+
+def check() -> None:
+    """Raise JobCancelled if the running job is cancelled or its time budget is spent
+    """
+    if _job is not None:
+        _job.check()
+
+
+def track(iterable: Iterable, step: str, total: int = None) -> Iterator:
+    """Report the progress of a python loop to the running job
+
+    Parameters
+    ----------
+    iterable : Iterable
+        items of the loop
+    step     : str
+        name of the loop
+    total    : int
+        the number of items, len(iterable) is used if it is not given
+
+    Returns
+    -------
+    Iterator
+        the same items
+    """
+    if _job is None:
+        yield from iterable
+        return
+
+    job = _job
+    if total is None:
+        total = len(iterable) if hasattr(iterable, '__len__') else 0
+
+    job.report(step, 0.)
+    for count, item in enumerate(iterable, 1):
+        yield item
+        job.report(step, min(count / total, 1.) if total else 0.)
+
+
+def update_filter(vtk_filter, step: str):
+    """Update a vtk filter while reporting its progress to the running job
+    The filter is aborted once the job is cancelled or its time budget is spent,
+    how soon it stops depends on how often the filter reports its progress
+
+    Parameters
+    ----------
+    vtk_filter
+        vtk filter to update
+    step       : str
+        name of the filter
+
+    Returns
+    -------
+        the same vtk filter
+    """
+    if _job is None:
+        vtk_filter.Update()
+        return vtk_filter
+
+    job = _job
+
+    # an exception raised in an observer doesn't reach here, so the filter is aborted instead
+    def on_progress(obj, event):
+        if job.callback is not None:
+            job.callback(step, obj.GetProgress(), job.elapsed())
+        if job.should_stop():
+            obj.AbortExecuteOn()
+
+    job.check()
+    observer = vtk_filter.AddObserver('ProgressEvent', on_progress)
+    try:
+        vtk_filter.Update()
+    finally:
+        vtk_filter.RemoveObserver(observer)
+        vtk_filter.AbortExecuteOff()
+
+    # the output of an aborted filter is incomplete
+    job.check()
+    return vtk_filter
+
+
+def print_progress() -> Callable[[str, float, float], None]:
+    """Create a callback that prints the progress on one line of the console
+
+    Returns
+    -------
+    Callable[[str, float, float], None]
+        callback for Job
+    """
+    last = {'step': None, 'percent': None}
+
+    def callback(step: str, fraction: float, elapsed: float) -> None:
+        percent = int(fraction * 100)
+        # vtk filters and loops report often, so only a changed percentage is printed
+        if step == last['step'] and percent == last['percent']:
+            return
+
+        last['step'] = step
+        last['percent'] = percent
+        print(f'\r  {step}: {percent:3d}% ({elapsed:.1f} s)'.ljust(80), end='\n' if percent >= 100 else '',
+              flush=True)
+
+    return callback
@@ -1,10 +1,16 @@
 import argparse
+import os
 import sys
 import textwrap
 from graphic_handler.graphic_util import save_object, smooth_mesh, smooth_mesh_laplacian
+from graphic_handler.mesh_smoother import smooth_mesh_laplacian_sparse, smooth_mesh_taubin
 from graphic_handler.graphic_generator import *
+from graphic_handler.algo_compare import save_compare_table
+from graphic_handler.parallel_util import set_num_threads
+from pipeline_handler.pipeline import Pipeline
+from job_handler.job import Job, JobCancelled, print_progress, run_job
+from graphic_handler.cost_model import DEFAULT_MODEL_PATH, calibrate_cost_model, load_cost_model, select_algorithm
 
-from dicom_handler import dicom_decoder, corr_finder
 import inquirer
 
 
@@ -35,11 +41,74 @@ def read_opt(args: list) -> argparse.Namespace:
                        iv  : creating mesh using DICOM image and voxel object information\
                        """)
                         )
-    parser.add_argument('--smo', required=False, choices=['lap', 'win'], type=str, dest='smooth',
+    parser.add_argument('--smo', required=False, choices=['lap', 'win', 'slap', 'tau'], type=str, dest='smooth',
                         help=textwrap.dedent("""\
                         algorithm for smoothing
-                        lap : Laplacian algorithm
-                        win : vtk's WindowedSincPolyDataFilter\
+                        lap  : Laplacian algorithm
+                        win  : vtk's WindowedSincPolyDataFilter
+                        slap : Laplacian algorithm on a sparse adjacency matrix
+                        tau  : Taubin algorithm on a sparse adjacency matrix\
+                        """)
+                        )
+    parser.add_argument('--smo-weight', required=False, choices=['uniform', 'cotangent'], default='uniform',
+                        type=str, dest='smooth_weight',
+                        help='weight of neighbouring vertices for slap and tau smoothing')
+    parser.add_argument('--sigma', required=False, type=float, dest='sigma',
+                        help='standard deviation (mm) of gaussian smoothing applied to the volume before meshing')
+    parser.add_argument('--downsample-sigma', required=False, type=float, dest='downsample_sigma',
+                        help=textwrap.dedent("""\
+                        smooth a shrunk volume when --sigma is at least this many voxels along an axis
+                        (faster for a large sigma)\
+                        """)
+                        )
+    parser.add_argument('--min-voxels', required=False, type=int, dest='min_voxels',
+                        help='remove connected components of the label smaller than this number of voxels')
+    parser.add_argument('--min-volume', required=False, type=float, dest='min_volume',
+                        help='remove connected components of the label smaller than this volume (mm^3)')
+    parser.add_argument('--keep-largest', required=False, type=int, dest='keep_largest',
+                        help='keep only this many largest connected components of the label')
+    parser.add_argument('--threads', required=False, type=int, dest='threads',
+                        help='the number of threads for vtk filters (default: all cores)')
+    parser.add_argument('--compare', default=False, action='store_true', dest='compare',
+                        help=textwrap.dedent("""\
+                        run every surface algorithm in parallel on one prepared volume
+                        the name of each algorithm is appended to the output file name
+                        and runtime, triangle count, surface area and peak memory are saved to <output>_compare.csv\
+                        """)
+                        )
+    parser.add_argument('--benchmark', default=False, action='store_true', dest='benchmark',
+                        help=textwrap.dedent("""\
+                        measure every surface algorithm on one prepared volume at 1, 1/2 and 1/4 resolution
+                        with a single thread and all cores, and the peak memory of the volume's data type
+                        and of float32, the results are saved to <output>_benchmark.csv\
+                        """)
+                        )
+    parser.add_argument('--cache', required=False, dest='cache_dir',
+                        help='directory path to keep intermediate results between runs')
+    parser.add_argument('--quantize', default=False, action='store_true', dest='quantize',
+                        help='store vertices as 16-bit integers (.glb output)')
+    parser.add_argument('--oct-normals', default=False, action='store_true', dest='oct_normals',
+                        help='store normals with 16-bit octahedral encoding (.glb output)')
+    parser.add_argument('--export-report', default=False, action='store_true', dest='export_report',
+                        help='compare size and time of .glb and .ply output with legacy vtk output')
+    parser.add_argument('--time-budget', required=False, type=float, dest='time_budget',
+                        help='stop the conversion after this many seconds without leaving a partial output')
+    parser.add_argument('--progress', default=False, action='store_true', dest='progress',
+                        help='print the progress of each step')
+    parser.add_argument('--surface-time', required=False, type=float, dest='surface_time',
+                        help=textwrap.dedent("""\
+                        time budget (seconds) of surface extraction for the auto algorithm
+                        (default: the time left of --time-budget)\
+                        """)
+                        )
+    parser.add_argument('--max-triangles', required=False, type=int, dest='max_triangles',
+                        help='the maximum number of triangles for the auto algorithm')
+    parser.add_argument('--cost-model', required=False, default=DEFAULT_MODEL_PATH, dest='cost_model',
+                        help=f'cost model file for the auto algorithm (default: {DEFAULT_MODEL_PATH})')
+    parser.add_argument('--calibrate', default=False, action='store_true', dest='calibrate',
+                        help=textwrap.dedent("""\
+                        measure the surface algorithms on this machine with the prepared volume
+                        and save the cost model for the auto algorithm, no mesh is created\
                         """)
                         )
     parser.add_argument('-o', required=True, default='./output.vtk', dest='output_path',
@@ -50,78 +119,103 @@ def read_opt(args: list) -> argparse.Namespace:
 
 if __name__ == '__main__':
     opts = read_opt(sys.argv[1::])
-    if opts.src != 'pc':
+    if (opts.compare or opts.benchmark or opts.calibrate) and opts.src == 'pc':
+        raise ValueError('comparing surface algorithms needs a volume source (img, vox, iv)')
+
+    if (opts.quantize or opts.oct_normals) and not opts.output_path.endswith('.glb'):
+        raise ValueError('--quantize and --oct-normals are only available for .glb output')
+
+    if opts.src != 'pc' and not opts.compare and not opts.benchmark and not opts.calibrate:
         questions = [
             inquirer.List('algorithm',
                           message="What algorithm do you want to use?",
-                          choices=['marching cubes', 'discrete marching cubes', 'synchronized templates 3D',
+                          choices=['auto', 'marching cubes', 'discrete marching cubes', 'synchronized templates 3D',
                                    'flying edges'],
                           ),
         ]
         answer = inquirer.prompt(questions)
 
-    # decode dicom files for converting a dicom file to a dicom image
-    decoder = dicom_decoder.DicomDecoder(opts.input_dir)
-
-    decoder.read_info()
-
-    print('Snippet of imported files:')
-    print(*decoder.get_files()[0:3], sep='\n')
-
-    decoder.convert_dcm2img()
-    decoder.calculate_hounsfield()
-
-    corr = corr_finder.Correspondence(decoder.get_info())
-
-    if opts.src == 'img':
-        print('Retrieving DICOM image...', end=' ', flush=True)
-        imgs = decoder.get_imgs()
-        print('Done')
-
-        print('Calculating boundary and voxel size...', end=' ', flush=True)
-        edge_indices = decoder.collect_edge()
-        edge_points = corr.convert_2d_3d(edge_indices)
-        bounds = corr.find_boundary(edge_points)
-        voxel_size = corr.calculate_voxel_size()
-        print('Done')
-
-        print('Converting into mesh...', end=' ', flush=True)
-        mesh = convert_img2mesh(imgs, bounds, voxel_size, smooth=False)
-        print('Done')
-
-    else:
-        print('Collecting label location...', end=' ', flush=True)
-        indices = decoder.collect_label_loc()
-        print('Done')
-
-        print('Converting 2d coordinate to 3d coordinate...', end=' ', flush=True)
-        points = corr.convert_2d_3d(indices)
-        print('Done')
-
-        if opts.src == 'pc':
-            mesh = generate_pointcloud(points)
-            mesh = convert_pcd2mesh(mesh)
-        else:
-            print('Converting 3d point to 3d voxel center point...', end=' ', flush=True)
-            voxel_points, voxel_size = corr.calculate_voxel_center(points)
-            print('Done')
-
-            mesh = generate_voxel(voxel_points, voxel_size)
-
-            print('Converting into mesh...', end=' ', flush=True)
-            if opts.src == 'vox':
-                mesh = convert_voxel2mesh(mesh, voxel_size)
+        # calibration is a separate step, so that it never takes the time budget of a conversion
+        if answer['algorithm'] == 'auto':
+            model = load_cost_model(opts.cost_model)
+            if model is None:
+                raise ValueError(f'no cost model of this machine is found in {opts.cost_model}, '
+                                 f'run with --calibrate first')
+
+    set_num_threads(opts.threads)
+
+    # Ctrl+C and the time budget stop the job at the next progress report
+    job = Job(budget=opts.time_budget, callback=print_progress() if opts.progress else None)
+    try:
+        with run_job(job):
+            pipeline = Pipeline(opts.input_dir, cache_dir=opts.cache_dir)
+
+            print('Snippet of imported files:')
+            print(*pipeline.run('info').get_files()[0:3], sep='\n')
+
+            volume_params = {'sigma': opts.sigma, 'min_voxels': opts.min_voxels, 'min_volume': opts.min_volume,
+                             'keep_largest': opts.keep_largest, 'downsample_sigma': opts.downsample_sigma}
+
+            if opts.compare:
+                results = pipeline.compare(opts.src, opts.output_path, **volume_params)
+                for result in results:
+                    print(f"{result['algorithm']}: {result['runtime']:.3f} s, {result['n_triangles']} triangles, "
+                          f"area {result['surface_area']:.1f}, peak {result['peak_mb']:.1f} MB "
+                          f"({result['volume_dtype']}), saved to {result['output']}")
+                sys.exit(0)
+
+            if opts.benchmark:
+                results = pipeline.benchmark(opts.src, **volume_params)
+                for result in results:
+                    print(f"{result['algorithm']} at 1/{result['factor']} resolution on {result['n_threads']} "
+                          f"thread(s): {result['runtime']:.3f} s, {result['n_triangles']} triangles, "
+                          f"peak {result['peak_mb']:.1f} MB ({result['volume_dtype']}), "
+                          f"float32: {result['float32_peak_mb']:.1f} MB")
+
+                benchmark_path = f'{os.path.splitext(opts.output_path)[0]}_benchmark.csv'
+                save_compare_table(results, benchmark_path)
+                print(f'Saved to {benchmark_path}')
+                sys.exit(0)
+
+            if opts.calibrate:
+                volume = pipeline.run(f'volume_{opts.src}', **volume_params)
+                print('Calibrating the cost model on this machine...', end=' ', flush=True)
+                calibrate_cost_model(volume, opts.cost_model)
+                print(f'Done, saved to {opts.cost_model}')
+                sys.exit(0)
+
+            if opts.src == 'pc':
+                mesh = pipeline.mesh(opts.src)
+            elif answer['algorithm'] == 'auto':
+                volume = pipeline.run(f'volume_{opts.src}', **volume_params)
+
+                # preparing the volume takes a part of the budget, so the job stops here if nothing is left
+                job.check()
+                surface_time = opts.surface_time if opts.surface_time is not None else job.remaining()
+                choice = select_algorithm(model, volume, time_budget=surface_time, max_triangles=opts.max_triangles)
+                print(f"Auto algorithm: {choice['algorithm']} at 1/{choice['downsample']} resolution "
+                      f"(predicted {choice['runtime']:.2f} s, {choice['n_triangles']:.0f} triangles), "
+                      f"because {choice['reason']}")
+
+                mesh = pipeline.mesh(opts.src, algo=choice['algorithm'], downsample=choice['downsample'],
+                                     **volume_params)
             else:
-                imgs = decoder.get_imgs()
-                mesh = convert_voxel2mesh(mesh, voxel_size, combine_img=True, imgs=imgs)
+                mesh = pipeline.mesh(opts.src, algo=answer['algorithm'], **volume_params)
+
+            if opts.smooth is not None:
+                if opts.smooth == 'lap':
+                    mesh = smooth_mesh_laplacian(mesh)
+                elif opts.smooth == 'slap':
+                    mesh = smooth_mesh_laplacian_sparse(mesh, weight=opts.smooth_weight)
+                elif opts.smooth == 'tau':
+                    mesh = smooth_mesh_taubin(mesh, weight=opts.smooth_weight)
+                else:
+                    mesh = smooth_mesh(mesh)
+
+            print(f'Saving the output to {opts.output_path}...', end=' ', flush=True)
+            save_object(mesh, opts.output_path, quantize=opts.quantize, oct_normals=opts.oct_normals,
+                        report=opts.export_report)
             print('Done')
-
-    if opts.smooth is not None:
-        if opts.smooth == 'lap':
-            mesh = smooth_mesh_laplacian(mesh)
-        else:
-            mesh = smooth_mesh(mesh)
-
-    print(f'Saving the output to {opts.output_path}...', end=' ', flush=True)
-    save_object(mesh, opts.output_path)
-    print('Done')
+    except JobCancelled as e:
+        print(f'\nStopped: {e}')
+        sys.exit(1)
@@ -0,0 +1,410 @@
+import copy as cp
+import hashlib
+import os
+import pickle
+from typing import Callable, Iterable, List
+
+from dicom_handler import dicom_decoder, corr_finder
+from graphic_handler.graphic_generator import *
+from graphic_handler.algo_compare import benchmark_vol_algos, compare_vol_algos
+from job_handler.job import check
+
+
+# parameters for preparing a volume before surface extraction
+VOLUME_PARAMS = ('smooth', 'sigma', 'min_voxels', 'min_volume', 'keep_largest', 'downsample_sigma')
+
+
+class Stage:
+    """A step of the pipeline
+    A stage computes its result from the results of the stages it depends on and its own parameters
+    """
+
+    def __init__(self, name: str, func: Callable, deps: Iterable[str] = (), params: Iterable[str] = (),
+                 persist=False, desc='') -> None:
+        """Initialize the class
+
+        Parameters
+        ----------
+        name    : str
+            name of the stage
+        func    : Callable
+            function that receives the results of deps (in order) and the parameters of the stage as keywords
+        deps    : Iterable[str]
+            names of the stages that this stage depends on
+        params  : Iterable[str]
+            names of the parameters that this stage takes
+        persist : bool
+            whether the result can be stored in the disk cache (it has to be picklable)
+        desc    : str
+            message printed while the stage is running
+        """
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = tuple(params)
+        self.persist = persist
+        self.desc = desc
+
+
+class Pipeline:
+    """Convert labeled dicom files through explicit stages
+    info -> decode -> hounsfield -> label location -> 2D to 3D -> point cloud / voxel / mesh
+
+    The result of each stage is memoized by its inputs and parameters,
+    so that several outputs can be created from one series while decoding and transforming only once.
+    The memoized results are shared between the stages, so they should not be modified in place.
+    """
+
+    def __init__(self, dir_path: str, cache_dir: str = None, verbose=True) -> None:
+        """Initialize the class
+
+        Parameters
+        ----------
+        dir_path  : str
+            directory path that contains labeled dicom files
+        cache_dir : str
+            directory path to store the results of persistent stages, nothing is stored on disk if it is None
+        verbose   : bool
+            print a message for each computed stage
+        """
+        self.dir_path = dir_path
+        self.cache_dir = cache_dir
+        self.verbose = verbose
+        self.stages = {}
+        self.memo = {}
+        self.source_key = None
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.add_default_stages()
+
+    def add_stage(self, name: str, func: Callable, deps: Iterable[str] = (), params: Iterable[str] = (),
+                  persist=False, desc='') -> None:
+        """Register a stage, an existing stage with the same name is replaced
+
+        Parameters
+        ----------
+        name    : str
+            name of the stage
+        func    : Callable
+            function that receives the results of deps (in order) and the parameters of the stage as keywords
+        deps    : Iterable[str]
+            names of the stages that this stage depends on
+        params  : Iterable[str]
+            names of the parameters that this stage takes, the other parameters are passed to deps only
+        persist : bool
+            whether the result can be stored in the disk cache
+        desc    : str
+            message printed while the stage is running
+        """
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f'{name} depends on unknown stage {dep}')
+
+        self.stages[name] = Stage(name, func, deps, params, persist, desc)
+
+    def add_default_stages(self) -> None:
+        """Register the stages of the conversion from labeled dicom files
+        """
+        self.add_stage('info', self.read_info)
+        self.add_stage('decode', convert_dcm2img, ['info'], desc='Decoding DICOM files')
+        self.add_stage('hounsfield', calculate_hounsfield, ['decode'], desc='Calculating Hounsfield unit')
+        self.add_stage('corr', lambda dec: corr_finder.Correspondence(dec.get_info()), ['info'])
+        self.add_stage('images', lambda hu: hu.get_imgs(), ['hounsfield'], persist=True,
+                       desc='Retrieving DICOM image')
+        self.add_stage('label_loc', lambda hu: hu.collect_label_loc(), ['hounsfield'], persist=True,
+                       desc='Collecting label location')
+        self.add_stage('points', lambda corr, loc: corr.convert_2d_3d(loc), ['corr', 'label_loc'], persist=True,
+                       desc='Converting 2d coordinate to 3d coordinate')
+        self.add_stage('voxel_center', lambda corr, points: corr.calculate_voxel_center(points),
+                       ['corr', 'points'], persist=True, desc='Converting 3d point to 3d voxel center point')
+        self.add_stage('voxel_size', lambda corr: corr.calculate_voxel_size(), ['corr'], persist=True)
+        self.add_stage('bounds', lambda imgs, corr: corr.calculate_bounds(imgs.shape), ['images', 'corr'],
+                       persist=True, desc='Calculating boundary')
+
+        self.add_stage('point_cloud', generate_pointcloud, ['points'])
+        self.add_stage('voxels', lambda center: generate_voxel(*center), ['voxel_center'],
+                       desc='Converting into voxel')
+
+        self.add_stage('volume_img', lambda imgs, bounds, size, **params: prepare_img_volume(imgs, bounds, size,
+                                                                                           **params),
+                       ['images', 'bounds', 'voxel_size'], VOLUME_PARAMS, persist=True, desc='Preparing volume')
+        self.add_stage('volume_vox', lambda vox, center, **params: prepare_voxel_volume(vox, center[1], **params),
+                       ['voxels', 'voxel_center'], VOLUME_PARAMS, persist=True, desc='Preparing volume')
+        self.add_stage('volume_iv',
+                       lambda vox, center, imgs, bounds, **params: prepare_voxel_volume(vox, center[1],
+                                                                                        combine_img=True, imgs=imgs,
+                                                                                        bounds=bounds, **params),
+                       ['voxels', 'voxel_center', 'images', 'bounds'], VOLUME_PARAMS, persist=True,
+                       desc='Preparing volume')
+
+        for src in ('img', 'vox', 'iv'):
+            self.add_stage(f'mesh_{src}',
+                           lambda volume, algo, downsample=1: get_vol_algo_dict()[algo](
+                               downsample_imagedata(volume, downsample)),
+                           [f'volume_{src}'], ['algo', 'downsample'], desc='Converting into mesh')
+        self.add_stage('mesh_pc', lambda pcd, **params: convert_pcd2mesh(pcd, **params), ['point_cloud'], ['alpha'],
+                       desc='Converting into mesh')
+
+    def read_info(self) -> dicom_decoder.DicomDecoder:
+        """Read information of dicom files
+
+        Returns
+        -------
+        dicom_decoder.DicomDecoder
+            decoder holding the dicom information
+        """
+        decoder = dicom_decoder.DicomDecoder(self.dir_path)
+        decoder.read_info()
+        return decoder
+
+    def get_source_key(self) -> str:
+        """Describe the dicom files by their names, sizes and modification times
+
+        Returns
+        -------
+        str
+            description of the input dicom files
+        """
+        if self.source_key is None:
+            entries = []
+            for name in sorted(os.listdir(self.dir_path)):
+                stat = os.stat(os.path.join(self.dir_path, name))
+                entries.append(f'{name}:{stat.st_size}:{stat.st_mtime_ns}')
+            self.source_key = os.path.abspath(self.dir_path) + '|' + '|'.join(entries)
+
+        return self.source_key
+
+    def get_key(self, name: str, params: dict) -> str:
+        """Create a key from the inputs and parameters of a stage
+
+        Parameters
+        ----------
+        name   : str
+            name of the stage
+        params : dict
+            parameters of the stage
+
+        Returns
+        -------
+        str
+            key of the stage result
+        """
+        stage = self.stages[name]
+        parts = [name, repr(sorted(self.select_params(name, params).items()))]
+        if stage.deps:
+            parts += [self.get_key(dep, params) for dep in stage.deps]
+        else:
+            parts.append(self.get_source_key())
+
+        return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def select_params(self, name: str, params: dict) -> dict:
+        """Select the parameters that a stage takes
+
+        Parameters
+        ----------
+        name   : str
+            name of the stage
+        params : dict
+            parameters given to the pipeline
+
+        Returns
+        -------
+        dict
+            parameters of the stage, None is regarded as not given
+        """
+        return {k: v for k, v in params.items() if k in self.stages[name].params and v is not None}
+
+    def run(self, name: str, **params):
+        """Return the result of a stage, computing it and its dependencies only if it isn't memoized
+
+        Parameters
+        ----------
+        name   : str
+            name of the stage
+        params : dict
+            parameters of the stage and the stages it depends on
+
+        Returns
+        -------
+            result of the stage
+        """
+        if name not in self.stages:
+            raise ValueError(f'{name} is not a stage of the pipeline')
+
+        stage = self.stages[name]
+        key = self.get_key(name, params)
+        if key in self.memo:
+            return self.memo[key]
+
+        cache_path = None
+        if stage.persist and self.cache_dir is not None:
+            cache_path = os.path.join(self.cache_dir, f'{name}-{key}.pkl')
+            if os.path.isfile(cache_path):
+                with open(cache_path, 'rb') as f:
+                    self.memo[key] = load_result(f)
+                return self.memo[key]
+
+        inputs = [self.run(dep, **params) for dep in stage.deps]
+        check()
+
+        if self.verbose and stage.desc:
+            print(f'{stage.desc}...', end=' ', flush=True)
+        result = stage.func(*inputs, **self.select_params(name, params))
+        if self.verbose and stage.desc:
+            print('Done')
+
+        if cache_path is not None:
+            # renamed at the end, so that an interrupted write doesn't leave a broken cache entry
+            tmp_path = cache_path + '.partial'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    dump_result(result, f)
+                os.replace(tmp_path, cache_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        self.memo[key] = result
+        return result
+
+    def mesh(self, src: str, **params) -> pv.PolyData:
+        """Return a mesh created from the given source
+
+        Parameters
+        ----------
+        src    : str
+            source for creating mesh ('img', 'pc', 'vox', 'iv')
+        params : dict
+            parameters for creating mesh (ex. algo, downsample, sigma)
+
+        Returns
+        -------
+        pyvista.PolyData
+            mesh object
+        """
+        return self.run(f'mesh_{src}', **params)
+
+    def compare(self, src: str, output_path: str, n_workers=None, **params) -> List[dict]:
+        """Create meshes with every surface algorithm from one prepared volume at the same time
+
+        Parameters
+        ----------
+        src         : str
+            source for creating mesh ('img', 'vox', 'iv')
+        output_path : str
+            output file including file path, the name of each algorithm is appended to the file name
+        n_workers   : int
+            the number of worker processes, one per algorithm if it is not given
+        params      : dict
+            parameters for preparing the volume (ex. sigma)
+
+        Returns
+        -------
+        List[dict]
+            runtime, triangle count, surface area and peak memory of each algorithm
+        """
+        volume = self.run(f'volume_{src}', **params)
+        return compare_vol_algos(volume, output_path, n_workers=n_workers)
+
+    def benchmark(self, src: str, factors=(1, 2, 4), thread_counts: List[int] = None, **params) -> List[dict]:
+        """Measure every surface algorithm on one prepared volume, including the peak memory of its data type
+        and of float32
+
+        Parameters
+        ----------
+        src           : str
+            source for creating mesh ('img', 'vox', 'iv')
+        factors       : Iterable[int]
+            downsampling factors of the volume
+        thread_counts : List[int]
+            the numbers of threads, a single thread and all cores if it is not given
+        params        : dict
+            parameters for preparing the volume (ex. sigma)
+
+        Returns
+        -------
+        List[dict]
+            runtime, triangle count and peak memory of each measurement (see algo_compare.benchmark_vol_algos)
+        """
+        volume = self.run(f'volume_{src}', **params)
+        return benchmark_vol_algos(volume, factors=factors, thread_counts=thread_counts, measure_memory=True)
+
+    def clear(self) -> None:
+        """Drop the memoized results, the disk cache is kept
+        """
+        self.memo = {}
+
+
+def dump_result(result, f) -> None:
+    """Pickle the result of a stage, vtkImageData is stored in a compact form
+
+    Parameters
+    ----------
+    result
+        result of a stage
+    f
+        binary file object
+    """
+    if isinstance(result, vtk.vtkImageData):
+        result = ('vtkImageData', pack_imagedata(result))
+    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_result(f):
+    """Unpickle the result of a stage stored by dump_result
+
+    Parameters
+    ----------
+    f
+        binary file object
+
+    Returns
+    -------
+        result of a stage
+    """
+    result = pickle.load(f)
+    if isinstance(result, tuple) and len(result) == 2 and result[0] == 'vtkImageData':
+        result = unpack_imagedata(result[1])
+    return result
+
+
+def convert_dcm2img(decoder: dicom_decoder.DicomDecoder) -> dicom_decoder.DicomDecoder:
+    """Decode dicom images without changing the given decoder
+
+    Parameters
+    ----------
+    decoder : dicom_decoder.DicomDecoder
+        decoder holding the dicom information
+
+    Returns
+    -------
+    dicom_decoder.DicomDecoder
+        decoder holding decoded images
+    """
+    decoder = cp.copy(decoder)
+    decoder.convert_dcm2img()
+    return decoder
+
+
+def calculate_hounsfield(decoder: dicom_decoder.DicomDecoder) -> dicom_decoder.DicomDecoder:
+    """Calculate Hounsfield unit without changing the decoded images of the given decoder
+
+    Parameters
+    ----------
+    decoder : dicom_decoder.DicomDecoder
+        decoder holding decoded images
+
+    Returns
+    -------
+    dicom_decoder.DicomDecoder
+        decoder holding images in Hounsfield unit
+    """
+    # calculate_hounsfield replaces the image array instead of updating it,
+    # so a shallow copy keeps the decoded images of the original decoder
+    decoder = cp.copy(decoder)
+    decoder.calculate_hounsfield()
+    return decoder
@@ -2,6 +2,7 @@ import argparse
 import sys
 
 from graphic_handler.graphic_util import show_obj
+from graphic_handler.offscreen_renderer import render_batch, render_orbit
 
 
 def read_opt(args: list) -> argparse.Namespace:
@@ -20,7 +21,8 @@ def read_opt(args: list) -> argparse.Namespace:
     """
     parser = argparse.ArgumentParser(description="visualize 3D object from the input object")
 
-    parser.add_argument('-i', required=True, dest='input_obj', help='input 3D object file')
+    parser.add_argument('-i', required=True, nargs='+', dest='input_obj',
+                        help='input 3D object file (several files only with --batch)')
 
     ani_group = parser.add_mutually_exclusive_group()
     ani_group.add_argument('--no-ani', default=False, dest='animation', action='store_false',
@@ -28,14 +30,38 @@ def read_opt(args: list) -> argparse.Namespace:
 
     ani_group.add_argument('--ani', dest='output_path', help='save the orbiting object to output file')
 
+    ani_group.add_argument('--batch', dest='batch_dir',
+                           help='render the orbit and the thumbnail of every input object without a display '
+                                'and save them to the output directory')
+
+    parser.add_argument('--offscreen', default=False, action='store_true', dest='offscreen',
+                        help='render the orbit of --ani without a display (.gif or .mp4)')
+    parser.add_argument('--thumb', dest='thumbnail_path', help='save a thumbnail image with --ani --offscreen')
+    parser.add_argument('--ext', default='.gif', choices=['.gif', '.mp4'], dest='ext',
+                        help='animation format of --batch')
+    parser.add_argument('--workers', type=int, dest='n_workers',
+                        help='the number of rendering processes (default: all cores)')
+    parser.add_argument('--lod', type=int, default=200000, dest='max_cells',
+                        help='the maximum number of triangles rendered without a display')
+
     return parser.parse_args(args)
 
 
 if __name__ == '__main__':
     opts = read_opt(sys.argv[1::])
 
-    file_path = opts.input_obj
+    if opts.batch_dir:
+        render_batch(opts.input_obj, opts.batch_dir, ext=opts.ext, n_workers=opts.n_workers, max_cells=opts.max_cells)
+        sys.exit(0)
+
+    if len(opts.input_obj) > 1:
+        raise ValueError('several input objects can be rendered only with --batch')
+
+    file_path = opts.input_obj[0]
     output_path = opts.output_path
     is_ani = opts.animation if not output_path else True
 
-    show_obj(file_path, turning=is_ani, output_path=output_path)
+    if opts.offscreen and output_path:
+        render_orbit(file_path, output_path, opts.thumbnail_path, max_cells=opts.max_cells, n_workers=opts.n_workers)
+    else:
+        show_obj(file_path, turning=is_ani, output_path=output_path)